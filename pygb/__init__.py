@@ -68,19 +68,48 @@ else:
 
 from . import _pygb_screen as pyscreen
 
+calibrateConfidence = pyscreen.calibrateConfidence
 center = pyscreen.center
+clearNeedleCache = pyscreen.clearNeedleCache
+compileNeedleAtlas = pyscreen.compileNeedleAtlas
+diffImagePairs = pyscreen.diffImagePairs
+diffImages = pyscreen.diffImages
+embedImage = pyscreen.embedImage
+explainLocate = pyscreen.explainLocate
+getLastLocateStats = pyscreen.getLastLocateStats
 grab = pyscreen.grab
+invalidateLocateCache = pyscreen.invalidateLocateCache
 locate = pyscreen.locate
 locateAll = pyscreen.locateAll
+locateAllArray = pyscreen.locateAllArray
+locateAllInFiles = pyscreen.locateAllInFiles
 locateAllOnScreen = pyscreen.locateAllOnScreen
 locateCenterOnScreen = pyscreen.locateCenterOnScreen
+locateCenterOnScreenNear = pyscreen.locateCenterOnScreenNear
+locateNear = pyscreen.locateNear
+locateNearOnScreen = pyscreen.locateNearOnScreen
 locateOnScreen = pyscreen.locateOnScreen
 locateOnWindow = pyscreen.locateOnWindow
+loadNeedleAtlas = pyscreen.loadNeedleAtlas
+openRawImage = pyscreen.openRawImage
 pixel = pyscreen.pixel
 pixelMatchesColor = pyscreen.pixelMatchesColor
 screenshot = pyscreen.screenshot
+waitForImage = pyscreen.waitForImage
+waitForImageToVanish = pyscreen.waitForImageToVanish
 # showRegionOnScreen = pyscreen.showRegionOnScreen
 
+if sys.version_info[0:2] >= (3, 5):
+    # The asyncio versions use syntax that older versions of Python can't parse.
+    from ._pygb_async import (
+        alocate,
+        alocateAll,
+        alocateAllOnScreen,
+        alocateCenterOnScreen,
+        alocateOnScreen,
+        ascreenshot,
+    )
+
 
 try:
     import mouseinfo
@@ -407,13 +436,15 @@ Size = collections.namedtuple("Size", "width height")
 def _genericPyGBChecks(wrappedFunction):
     """
     A decorator that calls failSafeCheck() before the decorated function and
-    _handlePause() after it.
+    _handlePause() after it. It also discards the remembered locate results, since input usually changes the
+    screen and makes them unlikely to be needed again.
     """
 
     @functools.wraps(wrappedFunction)
     def wrapper(*args, **kwargs):
         failSafeCheck()
         returnVal = wrappedFunction(*args, **kwargs)
+        pyscreen.invalidateLocateCache()  # the input has probably changed what's on the screen
         _handlePause(kwargs.get("_pause", True))
         return returnVal
 
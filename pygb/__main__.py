@@ -1,2 +1,115 @@
+import argparse
+import glob
+import json
+import os
+import sys
+
 from . import displayMousePosition
-displayMousePosition()
\ No newline at end of file
+from . import _pygb_screen as pyscreen
+
+
+def _haystackFilenames(paths):
+    """
+    Yields the image filenames in `paths`, where each path is either a
+    directory (whose image files are searched, but not its subdirectories) or
+    a glob pattern such as 'screenshots/*.png'.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if os.path.splitext(filename)[1].lower() in pyscreen.IMAGE_EXTENSIONS:
+                    yield os.path.join(path, filename)
+        else:
+            for filename in sorted(glob.glob(path)):
+                yield filename
+
+
+def _locateCommand(args):
+    """
+    Runs the locate command, printing one line of JSON for each haystack.
+    """
+    for atlasFilename in args.atlas or ():
+        pyscreen.loadNeedleAtlas(atlasFilename)
+
+    kwargs = {}
+    if args.grayscale:
+        kwargs['grayscale'] = True
+    if args.confidence is not None:
+        kwargs['confidence'] = args.confidence
+    if args.prefilter:
+        kwargs['prefilter'] = True
+    if args.trim:
+        kwargs['trim'] = True
+    if args.limit is not None:
+        kwargs['limit'] = args.limit
+    if args.scales == 'auto':
+        kwargs['scales'] = 'auto'
+    elif args.scales is not None:
+        kwargs['scales'] = [float(scale) for scale in args.scales.split(',')]
+
+    for result in pyscreen.locateAllInFiles(args.needle, _haystackFilenames(args.haystacks), processes=args.processes, **kwargs):
+        result['seconds'] = round(result['seconds'], 4)
+        sys.stdout.write(json.dumps(result) + '\n')
+        sys.stdout.flush() # let whatever reads our output process results as they arrive
+
+
+def _atlasCommand(args):
+    """
+    Runs the atlas command, which compiles a directory of needle images into
+    a needle atlas file and prints the names of the needles in it.
+    """
+    scales = None
+    if args.scales == 'auto':
+        scales = 'auto'
+    elif args.scales is not None:
+        scales = [float(scale) for scale in args.scales.split(',')]
+    for name in pyscreen.compileNeedleAtlas(args.directory, args.atlas, scales=scales):
+        sys.stdout.write(pyscreen.ATLAS_PREFIX + name + '\n')
+
+
+def _embedCommand(args):
+    """
+    Runs the embed command, which prints the image file as a string that
+    can be pasted into a script and passed to the locate functions.
+    """
+    sys.stdout.write(pyscreen.embedImage(args.image, format=args.format) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pygb', description='With no command, displays the mouse position.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    locateParser = subparsers.add_parser('locate', help='locate needle images in directories of screenshots')
+    locateParser.add_argument('haystacks', nargs='+', help='directories or glob patterns of the images to search')
+    locateParser.add_argument('-n', '--needle', action='append', required=True, help='an image to locate (can be repeated)')
+    locateParser.add_argument('--atlas', action='append', help="a needle atlas whose needles can be given as 'atlas:name' (can be repeated)")
+    locateParser.add_argument('--grayscale', action='store_true', help='compare the images in grayscale')
+    locateParser.add_argument('--confidence', type=float, help='the match threshold (requires OpenCV or NumPy)')
+    locateParser.add_argument('--scales', help="comma-separated needle scales to try, or 'auto' (requires OpenCV)")
+    locateParser.add_argument('--prefilter', action='store_true', help="only search around the needle's rarest color (requires OpenCV)")
+    locateParser.add_argument('--trim', action='store_true', help="ignore the needles' flat background borders (requires OpenCV)")
+    locateParser.add_argument('--limit', type=int, help='the most matches to report per needle and haystack')
+    locateParser.add_argument('--processes', type=int, help='the number of worker processes (default: one per CPU)')
+
+    atlasParser = subparsers.add_parser('atlas', help='compile a directory of needle images into a needle atlas')
+    atlasParser.add_argument('directory', help='the directory of needle images')
+    atlasParser.add_argument('atlas', help='the atlas file to write')
+    atlasParser.add_argument('--scales', help="comma-separated needle scales to precompute, or 'auto' (requires OpenCV)")
+
+    embedParser = subparsers.add_parser('embed', help='print an image file as a string to paste into a script')
+    embedParser.add_argument('image', help='the image file to embed')
+    embedParser.add_argument('--format', choices=('png', 'raw'), default='png', help='png (the default) is shorter, raw is faster to decode')
+
+    args = parser.parse_args(argv)
+    if args.command == 'locate':
+        _locateCommand(args)
+    elif args.command == 'atlas':
+        _atlasCommand(args)
+    elif args.command == 'embed':
+        _embedCommand(args)
+    else:
+        displayMousePosition()
+
+
+if __name__ == '__main__':
+    main()
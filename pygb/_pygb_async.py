@@ -0,0 +1,124 @@
+# asyncio versions of PyGB's screenshot and locate functions, for Python 3.5 and later.
+# Each one runs its blocking work in a thread pool so that it doesn't hold up the event loop.
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+from . import _pygb_screen as pyscreen
+
+# The most screenshots and searches that run at once. This has no effect once the first
+# coroutine has started the thread pool.
+ASYNC_MAX_WORKERS = 4
+
+# asyncio.get_running_loop() was added in Python 3.7. Inside a coroutine, get_event_loop() returns the same loop.
+_getRunningLoop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+_executor = None
+_executorLock = threading.Lock()
+
+# The screenshots being taken, keyed by event loop and region, so that concurrent ascreenshot() calls share one.
+_pendingScreenshots = {}
+
+
+def _getExecutor():
+    """
+    Returns the thread pool that the coroutines run their blocking work in,
+    starting it with ASYNC_MAX_WORKERS threads the first time.
+    """
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=ASYNC_MAX_WORKERS)
+    return _executor
+
+
+async def _run(function, *args, timeout=None, **kwargs):
+    """
+    Calls function(*args, **kwargs) in the thread pool and returns what it
+    returns. Raises asyncio.TimeoutError if it takes more than `timeout`
+    seconds. If the coroutine times out or is cancelled, the call still runs
+    to the end in its thread, but its result is thrown away.
+    """
+    loop = _getRunningLoop()
+    future = loop.run_in_executor(_getExecutor(), functools.partial(function, *args, **kwargs))
+    return await asyncio.wait_for(future, timeout)
+
+
+async def ascreenshot(imageFilename=None, region=None, timeout=None):
+    """
+    Like screenshot(), but doesn't block the event loop. Calls made while
+    another one (for the same region) is taking its screenshot get the same
+    Image object instead of taking another screenshot, so it must not be
+    changed in place. Cancelling one of these calls, or having it time out,
+    doesn't affect the others.
+    """
+    if imageFilename is not None:
+        return await _run(pyscreen.screenshot, imageFilename, region=region, timeout=timeout)
+
+    loop = _getRunningLoop()
+    key = (loop, tuple(region) if region else None)
+    future = _pendingScreenshots.get(key)
+    if future is None:
+        future = loop.run_in_executor(_getExecutor(), functools.partial(pyscreen.screenshot, region=region))
+        _pendingScreenshots[key] = future
+        future.add_done_callback(lambda done: _pendingScreenshots.pop(key, None))
+    return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+
+async def alocate(needleImage, haystackImage, timeout=None, **kwargs):
+    """
+    Like locate(), but doesn't block the event loop.
+    """
+    return await _run(pyscreen.locate, needleImage, haystackImage, timeout=timeout, **kwargs)
+
+
+async def alocateAll(needleImage, haystackImage, timeout=None, **kwargs):
+    """
+    Like locateAll(), but doesn't block the event loop, and returns a list
+    of the matches instead of a generator.
+    """
+    return await _run(lambda: list(pyscreen.locateAll(needleImage, haystackImage, **kwargs)), timeout=timeout)
+
+
+async def alocateOnScreen(image, minSearchTime=0, timeout=None, **kwargs):
+    """
+    Like locateOnScreen(), but doesn't block the event loop. Concurrent calls
+    share their screenshot (see ascreenshot()). Raises asyncio.TimeoutError
+    if taking the screenshot and searching it takes more than `timeout`
+    seconds. With a `minSearchTime`, waitForImage() runs in the thread pool
+    instead, taking its own screenshots, and holds one of its threads until
+    it's done even if the coroutine times out first.
+    """
+    if minSearchTime > 0:
+        return await _run(pyscreen.waitForImage, image, minSearchTime, timeout=timeout, **kwargs)
+
+    async def locateOnScreenshot():
+        screenshotIm = await ascreenshot()
+        return await _run(pyscreen._locateOnScreenshot, image, screenshotIm, kwargs)
+
+    return await asyncio.wait_for(locateOnScreenshot(), timeout)
+
+
+async def alocateAllOnScreen(image, timeout=None, **kwargs):
+    """
+    Like locateAllOnScreen(), but doesn't block the event loop, and returns a
+    list of the matches instead of a generator. See alocateOnScreen().
+    """
+    async def locateAllOnScreenshot():
+        screenshotIm = await ascreenshot()
+        return await _run(lambda: list(pyscreen._locateAllCached(image, screenshotIm, **kwargs)))
+
+    return await asyncio.wait_for(locateAllOnScreenshot(), timeout)
+
+
+async def alocateCenterOnScreen(image, timeout=None, **kwargs):
+    """
+    Like locateCenterOnScreen(), but doesn't block the event loop. See
+    alocateOnScreen().
+    """
+    coords = await alocateOnScreen(image, timeout=timeout, **kwargs)
+    if coords is None:
+        return None
+    return pyscreen.center(coords)
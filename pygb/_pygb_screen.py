@@ -3,17 +3,26 @@
 
 __version__ = '0.1.28'
 
-from math import sqrt
+from math import log, sqrt
 import collections
+import base64
 import datetime
 import functools
+import hashlib
+import json
+import multiprocessing
 import os
+import struct
 import subprocess
 import sys
+import threading
 import time
+import weakref
+import zlib
 import errno
 
 from contextlib import contextmanager
+from io import BytesIO
 
 try:
     from PIL import Image
@@ -28,7 +37,14 @@ except ImportError:
 
 
 try:
-    import cv2, numpy
+    import numpy
+    _NUMPY_UNAVAILABLE = False
+except ImportError:
+    _NUMPY_UNAVAILABLE = True
+
+
+try:
+    import cv2
     useOpenCV = True
 except ImportError:
     useOpenCV = False
@@ -66,6 +82,95 @@ GRAYSCALE_DEFAULT = False
 # folks who would rather have it raise an exception.
 USE_IMAGE_NOT_FOUND_EXCEPTION = False
 
+# The needle scales that the locate functions try when passed scales='auto'. The
+# common display scaling settings are tried first, in order of popularity.
+AUTO_SCALES = (1.0, 1.25, 1.5, 2.0, 1.75, 0.8, 0.75, 0.67, 0.5)
+
+# The maximum number of locateOnScreen() and locateAllOnScreen() results kept so that
+# searching an unchanged screen for the same image again can skip the search. See
+# _locateAllCached().
+RESULT_CACHE_SIZE = 32
+
+# When the screen has changed since the last locateOnScreen() or locateAllOnScreen()
+# search for the same image, only the DIRTY_TILE_SIZE x DIRTY_TILE_SIZE pixel tiles
+# that changed are searched again, unless more than DIRTY_MAX_AREA of the screen
+# changed. See _locateAllDirty().
+DIRTY_TILE_SIZE = 32
+DIRTY_MAX_AREA = 0.25
+
+# The keypoint detector used by the locate functions when passed method='features':
+# either 'orb' or 'akaze'. FEATURE_MIN_MATCHES is the fewest keypoint matches that
+# must agree on the needle's position for it to count as found.
+FEATURE_DETECTOR = 'orb'
+FEATURE_MIN_MATCHES = 10
+
+# The lower and upper thresholds of the Canny edge detector used by the locate
+# functions when passed method='edges'.
+EDGE_THRESHOLDS = (50, 150)
+
+# The locate functions' prefilter=True option searches only around the haystack
+# pixels that have the needle's rarest color, unless those areas add up to more
+# than PREFILTER_MAX_AREA of the haystack, in which case it searches all of it.
+# PREFILTER_MIN_FRACTION is the least of the needle that a color must cover to be
+# picked, so that a few anti-aliased pixels aren't relied on.
+PREFILTER_MAX_AREA = 0.5
+PREFILTER_MIN_FRACTION = 0.01
+
+# The locate functions don't correlate the needle with the haystack windows whose
+# variance is less than VARIANCE_MIN_RATIO of the needle's, since a textured needle
+# can't match a flat (or nearly flat) window, and a flat needle only matches flat
+# windows of its own color. The windows' variances come from integral images (or
+# box filters, with OpenCV), so they take the same time for any needle size. With
+# OpenCV, when too few windows would be ruled out to save any time, only the
+# windows that would match are checked instead.
+VARIANCE_MIN_RATIO = 0.01
+
+# waitForImage() and waitForImageToVanish() check the screen again after
+# WAIT_MIN_INTERVAL seconds, and double the wait each time the screen hasn't
+# changed, up to WAIT_MAX_INTERVAL seconds. Mouse and keyboard actions wake them
+# up right away.
+WAIT_MIN_INTERVAL = 0.05
+WAIT_MAX_INTERVAL = 1.0
+
+# Needles compiled into an atlas by compileNeedleAtlas() are passed to the locate
+# functions as ATLAS_PREFIX followed by the needle's name, such as 'atlas:okButton',
+# once the atlas has been loaded with loadNeedleAtlas(). IMAGE_EXTENSIONS are the
+# files in a directory that are treated as images.
+ATLAS_PREFIX = 'atlas:'
+ATLAS_MAGIC = b'PYGBATL1'
+ATLAS_ALIGNMENT = 64
+IMAGE_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
+
+# The OpenCV locate functions' confidence, when they aren't passed one, is the one
+# that calibrateConfidence() recommended for the needle file, which is saved in a
+# JSON file named CALIBRATION_FILENAME in the needle's directory. Needles that
+# haven't been calibrated use DEFAULT_CONFIDENCE.
+CALIBRATION_FILENAME = '.pygb_calibration.json'
+DEFAULT_CONFIDENCE = 0.999
+
+# Without a confidence, the locate functions that don't use OpenCV first compare the
+# EXACT_SAMPLE_PIXELS needle pixels with the rarest colors in the needle against
+# every haystack position, and then check the whole needle only where those match.
+EXACT_SAMPLE_PIXELS = 4
+
+# With stream=True, the OpenCV locate functions search the haystack in bands of
+# STREAM_BAND_HEIGHT rows, from top to bottom, and yield each band's matches
+# before searching the next band.
+STREAM_BAND_HEIGHT = 128
+
+# explainLocate() reports the EXPLAIN_CANDIDATES best places the needle could be,
+# and a score heatmap that is at most EXPLAIN_HEATMAP_SIZE cells wide and tall.
+EXPLAIN_CANDIDATES = 5
+EXPLAIN_HEATMAP_SIZE = 64
+
+# embedImage() turns an image file into a string that starts with EMBEDDED_PREFIX,
+# which the locate functions accept in place of the image's filename.
+EMBEDDED_PREFIX = 'pygb:'
+
+# The maximum number of needle images whose loaded (and converted) pixel data
+# is kept in memory by the locate functions. See _getNeedleCacheEntry().
+NEEDLE_CACHE_SIZE = 100
+
 scrotExists = False
 try:
     if sys.platform not in ('java', 'darwin', 'win32'):
@@ -101,8 +206,11 @@ if sys.platform == 'win32':
                 raise WindowsError("windll.user32.ReleaseDC failed : return 0")
 
 Box = collections.namedtuple('Box', 'left top width height')
+ScaledBox = collections.namedtuple('ScaledBox', 'left top width height scale')
+Match = collections.namedtuple('Match', 'left top width height score scale seconds')
 Point = collections.namedtuple('Point', 'x y')
 RGB = collections.namedtuple('RGB', 'red green blue')
+ImageDiff = collections.namedtuple('ImageDiff', 'boxes ratio overlay')
 
 class PyScreezeException(Exception):
     """PyScreezeException is a generic exception class raised when a
@@ -131,17 +239,53 @@ def requiresPillow(wrappedFunction):
         return wrappedFunction(*args, **kwargs)
     return wrapper
 
+def requiresNumpy(wrappedFunction):
+    """
+    A decorator that marks a function as requiring NumPy to be installed.
+    This raises PyScreezeException if NumPy wasn't imported.
+    """
+    @functools.wraps(wrappedFunction)
+    def wrapper(*args, **kwargs):
+        if _NUMPY_UNAVAILABLE:
+            raise PyScreezeException('The NumPy package is required to use this function.')
+        return wrappedFunction(*args, **kwargs)
+    return wrapper
+
+def requiresOpenCV(wrappedFunction):
+    """
+    A decorator that marks a function as requiring OpenCV to be installed.
+    This raises PyScreezeException if OpenCV wasn't imported.
+    """
+    @functools.wraps(wrappedFunction)
+    def wrapper(*args, **kwargs):
+        if not useOpenCV:
+            raise PyScreezeException('The OpenCV package is required to use this function.')
+        return wrappedFunction(*args, **kwargs)
+    return wrapper
+
+
+if not _NUMPY_UNAVAILABLE:
+    # The dtype of the structured arrays returned by locateAllArray(). Each row has the same fields as a Match.
+    MATCH_DTYPE = numpy.dtype([('left', numpy.int32), ('top', numpy.int32), ('width', numpy.int32),
+                               ('height', numpy.int32), ('score', numpy.float32), ('scale', numpy.float64),
+                               ('seconds', numpy.float64)])
+
+
 def _load_cv2(img, grayscale=None):
     """
     TODO
     """
     # load images if given filename, or convert as needed to opencv
-    # Alpha layer just causes failures at this point, so flatten to RGB.
-    # RGBA: load with -1 * cv2.CV_LOAD_IMAGE_COLOR to preserve alpha
-    # to matchTemplate, need template and image to be the same wrt having alpha
+    # The alpha layer is flattened to RGB here. For needles, _loadNeedleMask_cv2()
+    # loads the alpha layer separately so that it can be passed to matchTemplate
+    # as a mask, since the template and image need to have the same channels.
 
     if grayscale is None:
         grayscale = GRAYSCALE_DEFAULT
+    if _isArrayFile(img):
+        img = _loadArrayFile(img)
+    elif _isEmbeddedImage(img):
+        img = _loadEmbeddedImage(img)
     if isinstance(img, (str, unicode)):
         # The function imread loads an image from the specified file and
         # returns it. If the image cannot be read (because of missing
@@ -157,8 +301,11 @@ def _load_cv2(img, grayscale=None):
                           "has improper permissions, or is an "
                           "unsupported or invalid format" % img)
     elif isinstance(img, numpy.ndarray):
+        if len(img.shape) == 3 and img.shape[2] == 4:
+            # BGRA, such as from openRawImage(); the alpha channel is flattened away like a PIL image's.
+            img_cv = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if grayscale else cv2.COLOR_BGRA2BGR)
         # don't try to convert an already-gray image to gray
-        if grayscale and len(img.shape) == 3:  # and img.shape[2] == 3:
+        elif grayscale and len(img.shape) == 3:  # and img.shape[2] == 3:
             img_cv = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         else:
             img_cv = img
@@ -173,155 +320,1571 @@ def _load_cv2(img, grayscale=None):
     return img_cv
 
 
+def _isArrayFile(img):
+    """
+    Returns True if `img` is the filename of a .npy file, which the locate
+    functions memory-map instead of reading.
+    """
+    return isinstance(img, (str, unicode)) and img.lower().endswith('.npy')
+
+
+@requiresNumpy
+def _loadArrayFile(filename):
+    """
+    Returns the image in the .npy file `filename` as a read-only numpy
+    memmap, so that only the pixels that are used are read from the file.
+    The file must hold a uint8 array that is grayscale (height x width),
+    BGR, or BGRA, the same as an image array passed to the locate functions.
+    """
+    array = numpy.load(filename, mmap_mode='r')
+    if array.dtype != numpy.uint8 or not (array.ndim == 2 or (array.ndim == 3 and array.shape[2] in (3, 4))):
+        raise ValueError('%s must hold a grayscale, BGR, or BGRA uint8 image, not a %s array of shape %s'
+                         % (filename, array.dtype, array.shape))
+    return array
+
+
+@requiresNumpy
+def openRawImage(filename, width, height, channels=4, offset=0):
+    """
+    Returns the uncompressed image in the file `filename`, which has
+    `channels` bytes per pixel (4 for BGRA, 3 for BGR, or 1 for grayscale)
+    starting `offset` bytes into the file, as a read-only numpy memmap that
+    can be passed to the locate functions. The file isn't read until its
+    pixels are used, and searching a region of it only reads that region,
+    which makes this the fastest way to search huge screenshots.
+    """
+    shape = (height, width, channels) if channels != 1 else (height, width)
+    return numpy.memmap(filename, dtype=numpy.uint8, mode='r', offset=offset, shape=shape)
+
+
+def _arrayToImage(array):
+    """
+    Returns the grayscale, BGR, or BGRA numpy array `array` as a grayscale or
+    RGB PIL image, for the locate functions that don't use OpenCV.
+    """
+    if array.ndim == 2:
+        return Image.fromarray(numpy.ascontiguousarray(array))
+    return Image.fromarray(numpy.ascontiguousarray(array[:, :, 2::-1])) # BGR(A) -> RGB
+
+
+def _openImageFile(filename):
+    """
+    Returns the haystack image file `filename` loaded once for searching
+    many times: a read-only memmap for a .npy file, otherwise a read-only BGR
+    array if locateAll() uses OpenCV, or a PIL image if it doesn't.
+    """
+    if _isArrayFile(filename):
+        return _loadArrayFile(filename)
+    if _isEmbeddedImage(filename):
+        return _loadEmbeddedImage(filename)
+    if locateAll is _locateAll_opencv:
+        image = _load_cv2(filename, False)
+        image.flags.writeable = False # lets every search of it share its conversions
+        return image
+    image = Image.open(filename)
+    image.load()
+    return image
+
+
+def _isEmbeddedImage(img):
+    """
+    Returns True if `img` is an image string made by embedImage().
+    """
+    return isinstance(img, (str, unicode)) and img.startswith(EMBEDDED_PREFIX)
+
+
+@requiresPillow
+def embedImage(image, format='png'):
+    """
+    Returns the image file `image` (or a PIL image) as a string that can be
+    pasted into a script and passed to the locate functions instead of the
+    image file, so that the script doesn't need the file. With 'png' format,
+    the string is EMBEDDED_PREFIX, 'png,', and the base64 of a PNG file.
+    With 'raw' format, it's EMBEDDED_PREFIX, 'raw,', the image's width,
+    height, and number of channels separated by 'x' and followed by ',',
+    and the base64 of the zlib-compressed grayscale, BGR, or BGRA pixels,
+    which is faster to decode but usually longer.
+    """
+    if not hasattr(image, 'convert'):
+        with open(image, 'rb') as imageFile:
+            image = Image.open(imageFile)
+            image.load() # Image.open() is lazy, so read the pixels before the file is closed
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    if format == 'png':
+        data = BytesIO()
+        image.save(data, 'PNG', optimize=True)
+        return '%spng,%s' % (EMBEDDED_PREFIX, base64.b64encode(data.getvalue()).decode('ascii'))
+    elif format == 'raw':
+        rawMode = {'L': 'L', 'RGB': 'BGR', 'RGBA': 'BGRA'}[image.mode]
+        data = zlib.compress(image.tobytes('raw', rawMode), 9)
+        return '%sraw,%dx%dx%d,%s' % (EMBEDDED_PREFIX, image.size[0], image.size[1], len(image.mode),
+                                      base64.b64encode(data).decode('ascii'))
+    raise ValueError("format must be 'png' or 'raw', not %r" % (format,))
+
+
+@requiresPillow
+def _loadEmbeddedImage(img):
+    """
+    Returns the image string `img` made by embedImage() decoded as a PIL
+    image, which is kept in the needle cache (keyed by the string's hash) so
+    that the string is only decoded once. The image must not be modified.
+    """
+    entry = _getNeedleCacheEntry(img)
+    if 'embedded' not in entry:
+        try:
+            format, rest = img[len(EMBEDDED_PREFIX):].split(',', 1)
+            if format == 'png':
+                image = Image.open(BytesIO(base64.b64decode(rest)))
+                image.load()
+            elif format == 'raw':
+                size, data = rest.split(',', 1)
+                width, height, channels = [int(number) for number in size.split('x')]
+                mode, rawMode = {1: ('L', 'L'), 3: ('RGB', 'BGR'), 4: ('RGBA', 'BGRA')}[channels]
+                image = Image.frombytes(mode, (width, height), zlib.decompress(base64.b64decode(data)), 'raw', rawMode)
+            else:
+                raise ValueError('unknown format %r' % (format,))
+        except (ValueError, KeyError, IOError, OSError, zlib.error) as ex:
+            raise ValueError('Failed to decode the embedded image %.40s...: %s' % (img, ex))
+        entry['embedded'] = image
+    return entry['embedded']
+
+
+_needleCache = collections.OrderedDict()
+_needleCacheLock = threading.Lock()
+
+
+def _needleCacheKey(img):
+    """
+    Returns a hashable key that identifies the needle image `img`, or None if
+    `img` can't be cached. Only filenames are cached, since numpy arrays and
+    PIL images can be modified by the caller after they are passed in. The
+    key includes the file's modification time and size so that editing a
+    needle file invalidates its cache entry. Atlas needles are keyed by their
+    name and their atlas file, and embedded images by their contents' hash.
+    """
+    if isinstance(img, (str, unicode)) and img.startswith(ATLAS_PREFIX):
+        atlasFilename, atlasTime, record, data = _atlasRecord(img)
+        return ('atlas', img[len(ATLAS_PREFIX):], atlasFilename, atlasTime)
+    if _isEmbeddedImage(img):
+        return ('embedded', hashlib.sha1(img.encode('ascii')).hexdigest())
+    if isinstance(img, (str, unicode)):
+        try:
+            fileStat = os.stat(img)
+        except OSError:
+            return None # let the loader raise its usual error about the missing file
+        return (os.path.abspath(img), fileStat.st_mtime, fileStat.st_size)
+    return None
+
+
+def _getNeedleCacheEntry(img):
+    """
+    Returns the dict that holds the loaded and converted versions of the
+    needle image `img`. The dict is empty the first time a needle is seen,
+    and the loaders fill it in. Needles that can't be cached get a new empty
+    dict on every call. At most NEEDLE_CACHE_SIZE needles are kept; the least
+    recently used ones are discarded first.
+    """
+    key = _needleCacheKey(img)
+    if key is None:
+        return {}
+    with _needleCacheLock:
+        entry = _needleCache.pop(key, None)
+        if entry is None:
+            # An atlas needle's entry starts out with everything the atlas has precomputed.
+            entry = _atlasEntry(img) if key[0] == 'atlas' else {}
+        _needleCache[key] = entry # (re)inserting marks this as the most recently used entry
+        while len(_needleCache) > NEEDLE_CACHE_SIZE:
+            _needleCache.popitem(last=False)
+    return entry
+
+
+def clearNeedleCache():
+    """
+    Discards all of the needle images that the locate functions have cached.
+    """
+    with _needleCacheLock:
+        _needleCache.clear()
+
+
+_haystackCache = {}
+_haystackCacheLock = threading.Lock()
+
+# The ids of the screenshots that screenshot() took, which can share a lasting haystack cache entry
+# since the caller didn't make them. See _markScreenFrame().
+_screenFrames = set()
+
+
+_locateStats = threading.local()
+
+
+def getLastLocateStats():
+    """
+    Returns a dict of statistics about the last search done by this thread's
+    locate functions, such as the fraction of the haystack that the prefilter
+    let it skip ('prefilterSkipped'), the fraction of needle positions whose
+    variance ruled them out (see VARIANCE_MIN_RATIO) before any correlation
+    ('varianceSkipped'), or the number of positions left after
+    each stage of an exact search without OpenCV (see _exactFind()). Returns
+    an empty dict if this thread hasn't searched anything yet.
+    """
+    return dict(getattr(_locateStats, 'last', {}))
+
+
+def _markScreenFrame(img):
+    """
+    Marks the PIL image `img`, a screenshot taken by screenshot(), as one
+    that gets a lasting haystack cache entry, and returns it. Other PIL
+    images don't, since the caller may change them in place between
+    searches.
+    """
+    key = id(img)
+    with _haystackCacheLock:
+        _screenFrames.add(key)
+    weakref.finalize(img, _screenFrames.discard, key)
+    return img
+
+
+def _isCacheableHaystack(img):
+    """
+    Returns True if `img` gets a lasting haystack cache entry, which is the
+    case for screenshots taken by screenshot() and read-only numpy arrays.
+    """
+    if hasattr(img, 'convert'):
+        return id(img) in _screenFrames # assume its a PIL.Image
+    return not _NUMPY_UNAVAILABLE and isinstance(img, numpy.ndarray) and not img.flags.writeable
+
+
+def _getHaystackCacheEntry(img):
+    """
+    Returns the dict that holds data derived from the haystack image `img`
+    (such as its keypoints), so that it can be shared by every search of the
+    same haystack. The dict lasts as long as `img` does. Only screenshots
+    taken by screenshot() and read-only numpy arrays get a lasting dict, so
+    a screenshot must not be modified in place after it has been searched.
+    Other haystacks get a new empty dict on every call.
+    """
+    if not _isCacheableHaystack(img):
+        return {}
+
+    key = id(img)
+    with _haystackCacheLock:
+        entry = _haystackCache.get(key)
+        if entry is None:
+            entry = _haystackCache[key] = {}
+            # ids are reused once an object is garbage collected, so drop the entry along with the object.
+            weakref.finalize(img, _haystackCache.pop, key, None)
+    return entry
+
+
+def _loadHaystack_cv2(img, grayscale=None, half=False):
+    """
+    Like _load_cv2(), but keeps the converted image in the haystack cache so
+    that every search of the same frame shares one BGR conversion and one
+    grayscale conversion. The grayscale image is made from the cached BGR
+    image rather than converted from the original again. If `half` is True,
+    returns every other row and column of the image as a contiguous array,
+    which is also kept in the cache. The returned array is shared and must
+    not be modified.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    grayscale = bool(grayscale)
+    if not _isCacheableHaystack(img):
+        converted = _load_cv2(img, grayscale)
+        # A strided view avoids copying a haystack that is only searched once.
+        return converted[::2, ::2] if half else converted
+
+    entry = _getHaystackCacheEntry(img)
+    key = ('cv2', grayscale)
+    converted = entry.get(key)
+    if converted is None:
+        if grayscale:
+            converted = _load_cv2(_loadHaystack_cv2(img, False), True)
+        else:
+            converted = _load_cv2(img, False)
+        # If img is already in the right format, it isn't cached, since the entry must
+        # not refer to img or img would never be freed.
+        if converted is not img:
+            converted.flags.writeable = False
+            entry[key] = converted
+    if not half:
+        return converted
+
+    halfKey = ('cv2', grayscale, 'half')
+    if halfKey not in entry:
+        entry[halfKey] = converted[::2, ::2].copy()
+        entry[halfKey].flags.writeable = False
+    return entry[halfKey]
+
+
+def _loadHaystack_pillow(img, grayscale=None):
+    """
+    Returns the PIL image `img` converted to grayscale, or to RGB if it has
+    an alpha layer, for the Pillow locate path. Like _loadHaystack_cv2(), the
+    conversion is kept in the haystack cache and shared by every search of
+    the same image.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    entry = _getHaystackCacheEntry(img)
+    key = ('pillow', bool(grayscale))
+    if key not in entry:
+        if grayscale and img.mode != 'L':
+            entry[key] = ImageOps.grayscale(img)
+        elif not grayscale and img.mode == 'RGBA':
+            # if not using grayscale, make sure we are comparing RGB images, not RGBA images.
+            entry[key] = img.convert('RGB')
+        else:
+            return img # the entry must not refer to img, or img would never be freed
+    return entry[key]
+
+
+def _loadNeedle_cv2(img, grayscale=None):
+    """
+    Like _load_cv2(), but reuses the needle cache so that a needle file is
+    only read and decoded once. The returned array is shared and must not
+    be modified.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    entry = _getNeedleCacheEntry(img)
+    key = ('cv2', bool(grayscale))
+    if key not in entry:
+        entry[key] = _load_cv2(img, grayscale)
+    return entry[key]
+
+
+def _loadNeedleMask_cv2(img):
+    """
+    Returns a uint8 mask array made from the needle image's alpha channel,
+    with 255 for the pixels that are mostly opaque and 0 for the rest, or None
+    if the needle has no transparent pixels. Like the needle itself, the mask
+    is cached and must not be modified.
+    """
+    entry = _getNeedleCacheEntry(img)
+    if 'mask' not in entry:
+        alpha = None
+        if _isArrayFile(img):
+            img = _loadArrayFile(img)
+        elif _isEmbeddedImage(img):
+            img = _loadEmbeddedImage(img)
+        if isinstance(img, (str, unicode)):
+            img_cv = cv2.imread(img, cv2.IMREAD_UNCHANGED)
+            if img_cv is not None and img_cv.ndim == 3 and img_cv.shape[2] == 4:
+                alpha = img_cv[:, :, 3]
+                if alpha.dtype == numpy.uint16:
+                    alpha = (alpha >> 8).astype(numpy.uint8)
+        elif isinstance(img, numpy.ndarray):
+            if img.ndim == 3 and img.shape[2] == 4:
+                alpha = img[:, :, 3]
+        elif hasattr(img, 'convert'):
+            # assume its a PIL.Image; palette images can also have a transparent color
+            if 'A' in img.getbands() or 'transparency' in img.info:
+                alpha = numpy.array(img.convert('RGBA'))[:, :, 3]
+
+        if alpha is None or alpha.min() == 255:
+            entry['mask'] = None # no transparency, so don't slow down matchTemplate with a mask
+        else:
+            # Semi-transparent pixels take on some of the background's color, so they are left out of the comparison.
+            mask = numpy.where(alpha > 127, 255, 0).astype(numpy.uint8)
+            if not mask.any():
+                raise ValueError('the needle image is entirely transparent')
+            entry['mask'] = mask
+    return entry['mask']
+
+
+def _matchTemplateMasked(haystackImage, needleImage, needleMask):
+    """
+    Returns the TM_CCOEFF_NORMED result of matching `needleImage` against
+    `haystackImage` while ignoring the needle pixels where `needleMask` is 0.
+    """
+    try:
+        result = cv2.matchTemplate(haystackImage, needleImage, cv2.TM_CCOEFF_NORMED, mask=needleMask)
+    except cv2.error:
+        # Older versions of OpenCV only support masks with TM_SQDIFF and TM_CCORR_NORMED.
+        result = cv2.matchTemplate(haystackImage, needleImage, cv2.TM_CCORR_NORMED, mask=needleMask)
+    # Haystack areas that are a single flat color under the mask give a division by zero.
+    result[~numpy.isfinite(result)] = 0
+    return result
+
+
+@requiresPillow
+def _loadNeedle_pillow(img, grayscale=None):
+    """
+    Returns the needle image `img` as a PIL Image in the mode that
+    _locateAll_python() compares pixels in, reusing the needle cache so that
+    a needle file is only read and decoded once.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    entry = _getNeedleCacheEntry(img)
+    key = ('pillow', bool(grayscale))
+    if key not in entry:
+        if isinstance(img, (str, unicode)) and img.startswith(ATLAS_PREFIX):
+            if grayscale:
+                needleImage = Image.fromarray(numpy.array(entry[('cv2', True)]))
+            else:
+                needleImage = Image.fromarray(numpy.array(entry[('cv2', False)][:, :, ::-1]))
+        elif _isArrayFile(img):
+            needleImage = _arrayToImage(_loadArrayFile(img))
+        elif _isEmbeddedImage(img):
+            needleImage = _loadEmbeddedImage(img)
+        elif isinstance(img, (str, unicode)):
+            with open(img, 'rb') as needleFileObj:
+                needleImage = Image.open(needleFileObj)
+                needleImage.load() # Image.open() is lazy, so read the pixels before the file is closed
+        elif not _NUMPY_UNAVAILABLE and isinstance(img, numpy.ndarray):
+            needleImage = _arrayToImage(img)
+        else:
+            needleImage = img
+
+        if grayscale:
+            needleImage = ImageOps.grayscale(needleImage)
+        elif needleImage.mode == 'RGBA':
+            # if not using grayscale, make sure we are comparing RGB images, not RGBA images.
+            needleImage = needleImage.convert('RGB')
+        entry[key] = needleImage
+    return entry[key]
+
+
+def _loadScaledNeedle_cv2(img, grayscale, scale):
+    """
+    Returns a (needle, mask) tuple of the needle image resized by `scale`,
+    where mask is None if the needle has no transparent pixels. The resized
+    versions are kept in the needle cache, so each needle is only resized
+    once per scale.
+    """
+    needle = _loadNeedle_cv2(img, grayscale)
+    mask = _loadNeedleMask_cv2(img)
+    if scale == 1.0:
+        return needle, mask
+
+    entry = _getNeedleCacheEntry(img)
+    key = ('cv2', bool(grayscale), scale)
+    if key not in entry:
+        entry[key] = _resizeNeedle_cv2(needle, mask, scale)
+    return entry[key]
+
+
+def _resizeNeedle_cv2(needle, mask, scale):
+    """
+    Returns a (needle, mask) tuple of the needle array and its mask (which
+    can be None) resized by `scale`.
+    """
+    height, width = needle.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    # INTER_AREA avoids aliasing when shrinking, but is blocky when enlarging.
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+    scaledNeedle = cv2.resize(needle, size, interpolation=interpolation)
+    scaledMask = None
+    if mask is not None:
+        scaledMask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+    return scaledNeedle, scaledMask
+
+
+def _trimNeedle_cv2(needle, mask):
+    """
+    Returns a (needle, mask, left, top) tuple of the needle array with its
+    uniform border removed, where left and top are the number of columns and
+    rows removed from those sides. The border is the rows and columns on the
+    edges that are entirely the color of the top-left pixel or transparent.
+    The needle is returned as is if it has no such border, or if the rest of
+    it would be a single color, which can't be matched on its own.
+    """
+    uniform = needle == needle[0, 0]
+    if uniform.ndim == 3:
+        uniform = uniform.all(axis=2)
+    if mask is not None:
+        uniform |= mask == 0
+    rows = numpy.flatnonzero(~uniform.all(axis=1))
+    columns = numpy.flatnonzero(~uniform.all(axis=0))
+    if len(rows) == 0:
+        return needle, mask, 0, 0 # there's nothing but border
+
+    top, bottom, left, right = rows[0], rows[-1] + 1, columns[0], columns[-1] + 1
+    if (top, left, bottom, right) == (0, 0) + needle.shape[:2]:
+        return needle, mask, 0, 0
+    core = needle[top:bottom, left:right]
+    if core.min() == core.max():
+        return needle, mask, 0, 0
+    coreMask = None
+    if mask is not None:
+        coreMask = mask[top:bottom, left:right]
+        if coreMask.min() == 255:
+            coreMask = None
+    return core, coreMask, int(left), int(top)
+
+
+def _loadTrimmedNeedle_cv2(img, grayscale, scale, step):
+    """
+    Returns the (needle, mask, left, top) tuple from _trimNeedle_cv2() for the
+    needle image resized by `scale` and with only every `step`th row and
+    column kept, the way _locateAllArray_opencv() searches for it. These are
+    kept in the needle cache, so each needle is only trimmed once.
+    """
+    entry = _getNeedleCacheEntry(img)
+    key = ('trim', bool(grayscale), scale, step)
+    if key not in entry:
+        needle, mask = _loadScaledNeedle_cv2(img, grayscale, scale)
+        if mask is not None:
+            mask = mask[::step, ::step]
+        entry[key] = _trimNeedle_cv2(needle[::step, ::step], mask)
+    return entry[key]
+
+
+_atlasNeedles = {}
+_atlasLock = threading.Lock()
+
+
+def _atlasRecord(img):
+    """
+    Returns the (atlas filename, atlas modification time, header record,
+    memory-mapped data) tuple of the atlas needle named by the 'atlas:name'
+    string `img`. Raises IOError if no loaded atlas has that needle.
+    """
+    with _atlasLock:
+        found = _atlasNeedles.get(img[len(ATLAS_PREFIX):])
+    if found is None:
+        raise IOError('Failed to read %s because no needle atlas loaded with loadNeedleAtlas() has it' % img)
+    return found
+
+
+def _atlasArray(data, plane):
+    """
+    Returns the read-only array described by `plane`, an [offset, shape]
+    list from an atlas header, as a view of the atlas's memory-mapped data.
+    """
+    offset, shape = plane
+    return numpy.ndarray(tuple(shape), dtype=numpy.uint8, buffer=data, offset=offset)
+
+
+def _atlasEntry(img):
+    """
+    Returns a new needle cache entry for the atlas needle `img` that already
+    holds its BGR and grayscale arrays, its mask, its precompiled scales, and
+    the means and norms used by _matchTemplate_numpy(). The arrays are views
+    of the memory-mapped atlas, so they aren't copied into this process.
+    """
+    atlasFilename, atlasTime, record, data = _atlasRecord(img)
+    mask = _atlasArray(data, record['mask']) if record['mask'] else None
+    entry = {
+        ('cv2', False): _atlasArray(data, record['bgr']),
+        ('cv2', True): _atlasArray(data, record['gray']),
+        'mask': mask,
+        # _locateAll_python() compares RGB arrays, so its color means are in RGB order.
+        ('numpy', False): {'moments': (numpy.array(record['mean'][::-1]), record['normSquared'])},
+        ('numpy', True): {'moments': (numpy.array(record['grayMean']), record['grayNormSquared'])},
+    }
+    for scale, level in record['levels']:
+        levelMask = _atlasArray(data, level['mask']) if level['mask'] else None
+        entry[('cv2', False, scale)] = (_atlasArray(data, level['bgr']), levelMask)
+        entry[('cv2', True, scale)] = (_atlasArray(data, level['gray']), levelMask)
+    return entry
+
+
+def _needleMoments(array):
+    """
+    Returns a (mean, normSquared) tuple of the per-channel mean of the 3D
+    needle array and the sum of its squared differences from the mean, which
+    _matchTemplate_numpy() needs for every search.
+    """
+    mean = array.mean(axis=(0, 1))
+    return mean, float(((array - mean) ** 2).sum())
+
+
+@requiresNumpy
+def compileNeedleAtlas(directory, filename, scales=None):
+    """
+    Decodes every image file in `directory` (but not its subdirectories) and
+    writes them to the needle atlas file `filename`, which loadNeedleAtlas()
+    memory-maps so that the images don't have to be decoded again, and so
+    that processes that load the same atlas share its memory. Each needle is
+    named after its file, without the extension, and is located by passing
+    'atlas:name' to the locate functions.
+
+    The atlas holds each needle's BGR and grayscale pixels, its transparency
+    mask, and precomputed means and norms. If `scales` (a list, or 'auto'
+    for AUTO_SCALES) is given, the needle resized to each of those scales is
+    stored as well, which requires OpenCV. Returns the list of needle names.
+
+    The file starts with ATLAS_MAGIC, then the length of the JSON header as
+    an 8-byte little-endian integer, then the header, then the raw pixel
+    data. Every array starts at a multiple of ATLAS_ALIGNMENT bytes.
+    """
+    if scales == 'auto':
+        scales = AUTO_SCALES
+    scales = [float(scale) for scale in (scales or ()) if float(scale) != 1.0]
+    if scales and not useOpenCV:
+        raise NotImplementedError('The scales keyword argument is only available if OpenCV is installed.')
+
+    names = {}
+    for imageFilename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(imageFilename)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if name in names:
+            raise ValueError('%s and %s would both be named %r in the atlas' % (names[name], imageFilename, name))
+        names[name] = imageFilename
+
+    chunks = []
+    dataSize = [0]
+
+    def addArray(array):
+        # Returns the [offset, shape] of the array in the data, padded to the alignment.
+        array = numpy.ascontiguousarray(array, dtype=numpy.uint8)
+        plane = [dataSize[0], list(array.shape)]
+        padding = -array.nbytes % ATLAS_ALIGNMENT
+        chunks.append(array.tobytes() + b'\0' * padding)
+        dataSize[0] += array.nbytes + padding
+        return plane
+
+    needles = {}
+    for name in sorted(names):
+        with Image.open(os.path.join(directory, names[name])) as image:
+            rgba = numpy.array(image.convert('RGBA'))
+        bgr = numpy.ascontiguousarray(rgba[:, :, 2::-1])
+        if useOpenCV:
+            gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = numpy.array(Image.fromarray(rgba[:, :, :3]).convert('L'))
+        alpha = rgba[:, :, 3]
+        # The same mask that _loadNeedleMask_cv2() makes.
+        mask = None if alpha.min() == 255 else numpy.where(alpha > 127, 255, 0).astype(numpy.uint8)
+
+        mean, normSquared = _needleMoments(bgr)
+        grayMean, grayNormSquared = _needleMoments(gray[:, :, numpy.newaxis])
+        record = {'bgr': addArray(bgr), 'gray': addArray(gray), 'mask': addArray(mask) if mask is not None else None,
+                  'mean': mean.tolist(), 'normSquared': normSquared,
+                  'grayMean': grayMean.tolist(), 'grayNormSquared': grayNormSquared, 'levels': []}
+        for scale in scales:
+            scaledNeedle, scaledMask = _resizeNeedle_cv2(bgr, mask, scale)
+            scaledGray, scaledMask = _resizeNeedle_cv2(gray, mask, scale)
+            record['levels'].append([scale, {'bgr': addArray(scaledNeedle), 'gray': addArray(scaledGray),
+                                             'mask': addArray(scaledMask) if scaledMask is not None else None}])
+        needles[name] = record
+
+    header = json.dumps({'needles': needles}).encode('utf-8')
+    headerEnd = len(ATLAS_MAGIC) + 8 + len(header)
+    with open(filename, 'wb') as atlasFile:
+        atlasFile.write(ATLAS_MAGIC + struct.pack('<Q', len(header)) + header)
+        atlasFile.write(b'\0' * (-headerEnd % ATLAS_ALIGNMENT))
+        for chunk in chunks:
+            atlasFile.write(chunk)
+    return sorted(needles)
+
+
+@requiresNumpy
+def loadNeedleAtlas(filename):
+    """
+    Memory-maps the needle atlas file made by compileNeedleAtlas(), after
+    which its needles can be passed to the locate functions as 'atlas:name'.
+    If a needle has the same name as one in an atlas loaded earlier, this
+    atlas's needle replaces it. Returns the list of needle names.
+    """
+    with open(filename, 'rb') as atlasFile:
+        magic = atlasFile.read(len(ATLAS_MAGIC))
+        if magic != ATLAS_MAGIC:
+            raise ValueError('%s is not a needle atlas' % filename)
+        headerSize, = struct.unpack('<Q', atlasFile.read(8))
+        header = json.loads(atlasFile.read(headerSize).decode('utf-8'))
+    headerEnd = len(ATLAS_MAGIC) + 8 + headerSize
+    dataOffset = headerEnd + (-headerEnd % ATLAS_ALIGNMENT)
+
+    data = numpy.memmap(filename, dtype=numpy.uint8, mode='r', offset=dataOffset) if os.path.getsize(filename) > dataOffset else b''
+    atlasFilename, atlasTime = os.path.abspath(filename), os.stat(filename).st_mtime
+    with _atlasLock:
+        for name, record in header['needles'].items():
+            _atlasNeedles[name] = (atlasFilename, atlasTime, record, data)
+    return sorted(header['needles'])
+
+
+def _loadedAtlases():
+    """
+    Returns a sorted list of the filenames of the loaded needle atlases.
+    """
+    with _atlasLock:
+        return sorted(set(found[0] for found in _atlasNeedles.values()))
+
+
+def _colorCodes(image):
+    """
+    Returns an array of the quantized color of each pixel of the OpenCV
+    image, keeping the top 4 bits of each channel so that there are 4096
+    colors (or 16 shades of gray).
+    """
+    image = image >> 4
+    if image.ndim == 2:
+        return image.astype(numpy.uint16)
+    return (image[:, :, 0].astype(numpy.uint16) << 8) | (image[:, :, 1].astype(numpy.uint16) << 4) | image[:, :, 2]
+
+
+def _prefilterRects(needle, needleMask, haystackCodes, frameHistogram):
+    """
+    Returns a list of (left, top, width, height) rectangles of the haystack
+    that contain every position where the needle could be, found from where
+    the needle's rarest color (according to `frameHistogram`, the number of
+    pixels of each color in the whole frame) occurs in `haystackCodes`.
+    Returns an empty list if that color doesn't occur, or None if the
+    rectangles are too big for the prefilter to save any time.
+    """
+    needleCodes = _colorCodes(needle)
+    if needleMask is not None:
+        needleCodes = needleCodes[needleMask != 0]
+    needleHistogram = numpy.bincount(needleCodes.ravel(), minlength=len(frameHistogram))
+    candidates = numpy.flatnonzero(needleHistogram >= max(1, PREFILTER_MIN_FRACTION * needleCodes.size))
+    if len(candidates) == 0:
+        return None # the needle is entirely transparent
+    rarest = candidates[numpy.argmin(frameHistogram[candidates])]
+
+    hits = (haystackCodes == rarest).view(numpy.uint8)
+    if not hits.any():
+        return []
+
+    # Every needle position that covers a hit lies within the hit's neighborhood of the needle's size.
+    needleHeight, needleWidth = needle.shape[:2]
+    kernel = numpy.ones((2 * needleHeight - 1, 2 * needleWidth - 1), numpy.uint8)
+    areas = cv2.dilate(hits, kernel)
+    count, labels, rectStats, centroids = cv2.connectedComponentsWithStats(areas, connectivity=8)
+    rects = rectStats[1:, :4] # label 0 is the background
+    if (rects[:, 2] * rects[:, 3]).sum() > PREFILTER_MAX_AREA * haystackCodes.size:
+        return None
+    return rects.tolist()
+
+
+def _windowVariances(haystack, height, width):
+    """
+    Returns a (means, variances) tuple of arrays of the per-channel mean and
+    the variance, added up over the channels, of every `width` by `height`
+    window of the haystack, indexed by the window's top left corner. They come
+    from box filters, which take the same time for any window size.
+    """
+    rows, cols = haystack.shape[0] - height + 1, haystack.shape[1] - width + 1
+    channels = 1 if haystack.ndim == 2 else haystack.shape[2]
+    # With the anchor in the corner, each filtered pixel is the mean of the window that starts at it.
+    means = cv2.boxFilter(haystack, cv2.CV_64F, (width, height), anchor=(0, 0),
+                          borderType=cv2.BORDER_CONSTANT)[:rows, :cols]
+    squares = cv2.sqrBoxFilter(haystack, cv2.CV_64F, (width, height), anchor=(0, 0),
+                               borderType=cv2.BORDER_CONSTANT)[:rows, :cols]
+    variances = cv2.subtract(squares, cv2.multiply(means, means))
+    if channels > 1:
+        variances = cv2.transform(variances, numpy.ones((1, channels))) # added up over the channels
+    return means.reshape(rows, cols, channels), variances
+
+
+def _compatibleWindows(haystack, needle):
+    """
+    Returns a (compatible, flat) tuple of a boolean array that is True at
+    every needle position in the haystack where the window's variance
+    doesn't rule out a match, and whether the needle is flat. A textured
+    needle needs a textured window with at least VARIANCE_MIN_RATIO of its
+    variance, while a flat needle needs a flat window of the same color,
+    which is a perfect match.
+    """
+    needleHeight, needleWidth = needle.shape[:2]
+    channels = 1 if haystack.ndim == 2 else haystack.shape[2]
+    means, variances = _windowVariances(haystack, needleHeight, needleWidth)
+
+    needleMean, needleNormSquared = _needleMoments(needle.reshape(needleHeight, needleWidth, channels))
+    needleVariance = needleNormSquared / float(needleHeight * needleWidth)
+    # The variances are only off by rounding errors, which are far smaller than 1e-6.
+    if needleVariance < 1e-6:
+        sameColor = numpy.abs(means - needleMean) < 0.5
+        return (variances < 1e-6) & sameColor.all(axis=2), True
+    return (variances >= 1e-6) & (variances >= VARIANCE_MIN_RATIO * needleVariance), False
+
+
+def _varianceMayPrune(haystack, needle):
+    """
+    Returns whether the needle's variance may rule out enough of the
+    haystack's windows for _compatibleRects() to save any time, which is
+    estimated from the variances of the windows of only every few pixels
+    (up to every eighth) of the haystack, in a small fraction of the time. A
+    flat needle always may, since it needs no correlation at all.
+    """
+    needleHeight, needleWidth = needle.shape[:2]
+    channels = 1 if haystack.ndim == 2 else haystack.shape[2]
+    needleVariance = _needleMoments(needle.reshape(needleHeight, needleWidth, channels))[1] / float(needleHeight * needleWidth)
+    sample = min(8, needleHeight // 4, needleWidth // 4)
+    if needleVariance < 1e-6 or sample <= 1:
+        return True # for a small needle, the estimate would take about as long as the real thing
+    means, variances = _windowVariances(haystack[::sample, ::sample], needleHeight // sample, needleWidth // sample)
+    compatible = (variances >= 1e-6) & (variances >= VARIANCE_MIN_RATIO * needleVariance)
+    return numpy.count_nonzero(compatible) <= PREFILTER_MAX_AREA * compatible.size
+
+
+def _rejectFlatWindows(result, haystack, needle, confidence):
+    """
+    Sets the scores in the cv2.matchTemplate() `result` of the textured
+    needle to 0 at the haystack windows that _compatibleWindows() would rule
+    out, but only checks the windows that score above `confidence` and the
+    best one, which is much faster when there are only a few of them.
+    """
+    positions = numpy.flatnonzero(result > confidence)
+    if len(positions) > 256: # checking the windows one at a time is only quicker for a few of them
+        result[~_compatibleWindows(haystack, needle)[0]] = 0
+        return
+    best = result.argmax()
+    needleHeight, needleWidth = needle.shape[:2]
+    channels = 1 if haystack.ndim == 2 else haystack.shape[2]
+    area = float(needleHeight * needleWidth)
+    needleVariance = _needleMoments(needle.reshape(needleHeight, needleWidth, channels))[1] / area
+    for position in numpy.append(positions, best):
+        top, left = divmod(int(position), result.shape[1])
+        window = haystack[top:top + needleHeight, left:left + needleWidth].reshape(needleHeight, needleWidth, channels)
+        variance = _needleMoments(window.astype(numpy.float64))[1] / area
+        if variance < 1e-6 or variance < VARIANCE_MIN_RATIO * needleVariance:
+            result.flat[position] = 0
+    if result.flat[best] == 0 and result.max() > 0:
+        # The best window was flat, so the next best hasn't been checked: check them all.
+        result[~_compatibleWindows(haystack, needle)[0]] = 0
+
+
+def _compatibleRects(compatible, needleHeight, needleWidth):
+    """
+    Returns a list of (left, top, width, height) rectangles of the haystack
+    that contain every needle position where `compatible` is True, or None
+    if the rectangles are too big to save any time (see PREFILTER_MAX_AREA).
+    """
+    if numpy.count_nonzero(compatible) > PREFILTER_MAX_AREA * compatible.size:
+        return None
+    count, labels, rectStats, centroids = cv2.connectedComponentsWithStats(compatible.view(numpy.uint8), connectivity=8)
+    rects = rectStats[1:, :4] # label 0 is the background
+    if (rects[:, 2] * rects[:, 3]).sum() > PREFILTER_MAX_AREA * compatible.size:
+        return None
+    # Each rectangle of positions becomes the rectangle of haystack pixels that the needle covers from them.
+    rects[:, 2] += needleWidth - 1
+    rects[:, 3] += needleHeight - 1
+    return rects.tolist()
+
+
+def _loadHaystackColors_cv2(img, grayscale):
+    """
+    Returns a (codes, histogram) tuple of the _colorCodes() of the haystack
+    image and the number of its pixels of each color, which the prefilter
+    shares between every search of the same frame.
+    """
+    entry = _getHaystackCacheEntry(img)
+    key = ('colors', bool(grayscale))
+    if key not in entry:
+        codes = _colorCodes(_loadHaystack_cv2(img, grayscale))
+        entry[key] = codes, numpy.bincount(codes.ravel(), minlength=16 if grayscale else 4096)
+    return entry[key]
+
+
+def _loadNeedleEdges_cv2(img, scale):
+    """
+    Returns a (edges, mask) tuple of the needle image's Canny edge map at
+    `scale` and its mask (which can be None), for method='edges'. Like the
+    needle itself, these are kept in the needle cache.
+    """
+    entry = _getNeedleCacheEntry(img)
+    key = ('edges', scale)
+    if key not in entry:
+        needle, mask = _loadScaledNeedle_cv2(img, True, scale)
+        edges = cv2.Canny(needle, EDGE_THRESHOLDS[0], EDGE_THRESHOLDS[1])
+        if not edges.any():
+            raise ValueError('the needle image has no edges to match with method=\'edges\'')
+        entry[key] = edges, mask
+    return entry[key]
+
+
+def _loadHaystackEdges_cv2(img):
+    """
+    Returns the Canny edge map of the haystack image, for method='edges'.
+    It's made from the grayscale image in the haystack cache, and kept there
+    too, so it's shared by every needle searched for in the same frame.
+    """
+    entry = _getHaystackCacheEntry(img)
+    if 'edges' not in entry:
+        edges = cv2.Canny(_loadHaystack_cv2(img, True), EDGE_THRESHOLDS[0], EDGE_THRESHOLDS[1])
+        edges.flags.writeable = False
+        entry['edges'] = edges
+    return entry['edges']
+
+
+def _detectFeatures(image, mask=None):
+    """
+    Returns a (points, descriptors) tuple of the FEATURE_DETECTOR keypoints
+    found in the grayscale `image`, where points is an N x 2 float32 array of
+    the keypoints' x, y coordinates. descriptors is None if no keypoints were
+    found.
+    """
+    if FEATURE_DETECTOR == 'akaze':
+        if not hasattr(cv2, 'AKAZE_create'):
+            # OpenCV 5 moved AKAZE out of the main opencv-python package.
+            raise PyScreezeException('This version of OpenCV does not include AKAZE; set FEATURE_DETECTOR to \'orb\'.')
+        detector = cv2.AKAZE_create()
+    elif FEATURE_DETECTOR == 'orb':
+        # ORB's default of 500 keypoints is too few to cover a whole screen.
+        detector = cv2.ORB_create(nfeatures=max(500, image.size // 400))
+    else:
+        raise ValueError('FEATURE_DETECTOR must be \'orb\' or \'akaze\', not %r' % (FEATURE_DETECTOR,))
+    keypoints, descriptors = detector.detectAndCompute(image, mask)
+    points = numpy.array([keypoint.pt for keypoint in keypoints], dtype=numpy.float32).reshape(-1, 2)
+    return points, descriptors
+
+
+def _locateFeatures_opencv(needleImage, haystackImage, region=None):
+    """
+    Returns a (box, score) tuple of the Box around where the needle's
+    keypoints map to in the haystack and the fraction of the matching
+    keypoints that agree on it, or None if not enough of them agree. Unlike template matching,
+    this finds needles that are rotated, scaled, or skewed, but it only finds
+    one instance of the needle, and it needs needles with enough texture to
+    have FEATURE_MIN_MATCHES keypoints (a plain button usually doesn't).
+
+    The needle's keypoints are kept in the needle cache and the haystack's
+    keypoints are shared by every needle searched for in the same haystack.
+    """
+    needleEntry = _getNeedleCacheEntry(needleImage)
+    key = ('features', FEATURE_DETECTOR)
+    if key not in needleEntry:
+        needleEntry[key] = _detectFeatures(_loadNeedle_cv2(needleImage, True), _loadNeedleMask_cv2(needleImage))
+    needlePoints, needleDescriptors = needleEntry[key]
+
+    haystackEntry = _getHaystackCacheEntry(haystackImage)
+    if key not in haystackEntry:
+        haystackEntry[key] = _detectFeatures(_loadHaystack_cv2(haystackImage, True))
+    haystackPoints, haystackDescriptors = haystackEntry[key]
+
+    if region:
+        # The keypoints are found in the whole haystack so that they can be reused for any region.
+        inRegion = ((haystackPoints[:, 0] >= region[0]) & (haystackPoints[:, 0] < region[0] + region[2]) &
+                    (haystackPoints[:, 1] >= region[1]) & (haystackPoints[:, 1] < region[1] + region[3]))
+        haystackPoints = haystackPoints[inRegion]
+        if haystackDescriptors is not None:
+            haystackDescriptors = haystackDescriptors[inRegion]
+
+    if needleDescriptors is None or haystackDescriptors is None or \
+       len(needleDescriptors) < FEATURE_MIN_MATCHES or len(haystackDescriptors) < 2:
+        return None
+
+    # Both ORB and AKAZE have binary descriptors, which are compared by Hamming distance.
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    goodMatches = []
+    for pair in matcher.knnMatch(needleDescriptors, haystackDescriptors, k=2):
+        # Lowe's ratio test: skip keypoints that match two places in the haystack about equally well.
+        if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance:
+            goodMatches.append(pair[0])
+    if len(goodMatches) < FEATURE_MIN_MATCHES:
+        return None
+
+    sourcePoints = needlePoints[[match.queryIdx for match in goodMatches]].reshape(-1, 1, 2)
+    destinationPoints = haystackPoints[[match.trainIdx for match in goodMatches]].reshape(-1, 1, 2)
+    homography, inliers = cv2.findHomography(sourcePoints, destinationPoints, cv2.RANSAC, 5.0)
+    if homography is None or inliers.sum() < FEATURE_MIN_MATCHES:
+        return None
+
+    needleHeight, needleWidth = _loadNeedle_cv2(needleImage, True).shape[:2]
+    corners = numpy.float32([[0, 0], [needleWidth, 0], [needleWidth, needleHeight], [0, needleHeight]]).reshape(-1, 1, 2)
+    left, top, width, height = cv2.boundingRect(cv2.perspectiveTransform(corners, homography))
+    return Box(left, top, width, height), inliers.sum() / float(len(goodMatches))
+
+
+def _locateAllArray_opencv(needleImage, haystackImage, grayscale=None, limit=10000, region=None, step=1,
+                           confidence=None, scales=None, method=None, prefilter=False, trim=False):
+    """
+    Returns a MATCH_DTYPE structured array of every match, in the order that
+    _locateAll_opencv() yields them. Building the array takes a handful of
+    vectorized numpy operations no matter how many matches there are. See
+    _locateAll_opencv() for the arguments.
+    """
+    startTime = time.time()
+    stats = _locateStats.last = {}
+    if method == 'features':
+        found = _locateFeatures_opencv(needleImage, haystackImage, region)
+        if found is None:
+            if USE_IMAGE_NOT_FOUND_EXCEPTION:
+                raise ImageNotFoundException('Could not locate the image (too few matching keypoints)')
+            return numpy.zeros(0, dtype=MATCH_DTYPE)
+        box, score = found
+        return numpy.array([tuple(box) + (score, 1.0, time.time() - startTime)], dtype=MATCH_DTYPE)
+    elif method not in (None, 'template', 'edges'):
+        raise ValueError("method must be 'template', 'edges', or 'features', not %r" % (method,))
+    edges = method == 'edges'
+    if edges:
+        step, prefilter, trim = 1, False, False # see _locateAll_opencv()
+
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+
+    if confidence is None:
+        confidence = _calibratedConfidence(needleImage, grayscale)
+    confidence = float(confidence)
+
+    if scales is None:
+        searchScales = [1.0]
+    else:
+        if scales == 'auto':
+            scales = AUTO_SCALES
+        searchScales = [float(scale) for scale in scales]
+        lastScale = _getNeedleCacheEntry(needleImage).get('lastScale')
+        if lastScale in searchScales:
+            searchScales.remove(lastScale)
+            searchScales.insert(0, lastScale)
+
+    frame = _loadArrayFile(haystackImage) if _isArrayFile(haystackImage) else haystackImage
+    cropped = region and isinstance(frame, numpy.memmap) and not edges
+    if edges:
+        # The edges are found in the whole frame, so that they're the same for any region.
+        haystackImage = _loadHaystackEdges_cv2(frame)
+    elif cropped:
+        # Only read and convert the region's pixels of a memory-mapped image.
+        haystackImage = _load_cv2(frame[region[1]:region[1]+region[3], region[0]:region[0]+region[2]], grayscale)
+    else:
+        haystackImage = _loadHaystack_cv2(frame, grayscale)
+
+    if region:
+        if not cropped:
+            haystackImage = haystackImage[region[1]:region[1]+region[3],
+                                          region[0]:region[0]+region[2]]
+    else:
+        region = (0, 0)  # full image; these values used in the yield statement
+    haystackHeight, haystackWidth = haystackImage.shape[:2]
+
+    if step == 2:
+        confidence *= 0.95
+        if region[0] % 2 == 0 and region[1] % 2 == 0 and not cropped:
+            # The region starts on an even pixel, so it's a slice of the frame's cached half-size image.
+            top, left = region[1] // 2, region[0] // 2
+            haystackImage = _loadHaystack_cv2(frame, grayscale, half=True)[top:top + (haystackHeight + 1) // 2,
+                                                                           left:left + (haystackWidth + 1) // 2]
+        else:
+            haystackImage = haystackImage[::step, ::step]
+    else:
+        step = 1
+
+    if prefilter:
+        haystackCodes, frameHistogram = _loadHaystackColors_cv2(frame, grayscale)
+        if len(region) == 4:
+            haystackCodes = haystackCodes[region[1]:region[1]+region[3], region[0]:region[0]+region[2]]
+        haystackCodes = haystackCodes[::step, ::step]
+        searchedArea = skippedArea = 0
+
+    positionCount = rejectedCount = 0
+    highestConfidence = None
+    colorMissing = False
+    for scale in searchScales:
+        if edges:
+            needle, needleMask = _loadNeedleEdges_cv2(needleImage, scale)
+        else:
+            needle, needleMask = _loadScaledNeedle_cv2(needleImage, grayscale, scale)
+        needleHeight, needleWidth = needle.shape[:2]
+        if haystackHeight < needleHeight or haystackWidth < needleWidth:
+            if scales is not None:
+                continue # this scale is just too big for the haystack, but others may fit
+            # avoid semi-cryptic OpenCV error below if bad size
+            raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+
+        if step == 2:
+            needle = needle[::step, ::step]
+            if needleMask is not None:
+                needleMask = needleMask[::step, ::step]
+        searchHeight, searchWidth = needle.shape[:2]
+        trimLeft = trimTop = 0
+        if trim:
+            # Match only the trimmed needle's core, and convert its positions back to the whole needle's.
+            needle, needleMask, trimLeft, trimTop = _loadTrimmedNeedle_cv2(needleImage, grayscale, scale, step)
+
+        # The windows' variances are only all worked out when they may rule out enough windows to save time;
+        # otherwise _rejectFlatWindows() checks just the windows that would match.
+        compatible = None
+        flat = False
+        if needleMask is None and _varianceMayPrune(haystackImage, needle):
+            compatible, flat = _compatibleWindows(haystackImage, needle)
+
+        rects = None
+        if prefilter:
+            rects = _prefilterRects(needle, needleMask, haystackCodes, frameHistogram)
+            searchedArea += haystackCodes.size
+            if rects is not None:
+                skippedArea += haystackCodes.size - sum(width * height for left, top, width, height in rects)
+            stats['prefilterSkipped'] = skippedArea / float(searchedArea)
+        varianceRects = False
+        if rects is None and compatible is not None and not flat and compatible.any():
+            rects = _compatibleRects(compatible, needle.shape[0], needle.shape[1])
+            varianceRects = rects is not None
+
+        if needleMask is None:
+            # Count only the positions that the variances kept from being correlated at all.
+            rows, cols = haystackImage.shape[0] - needle.shape[0] + 1, haystackImage.shape[1] - needle.shape[1] + 1
+            positionCount += rows * cols
+            if compatible is not None and (flat or not compatible.any()):
+                rejectedCount += rows * cols
+            elif varianceRects:
+                rejectedCount += max(0, rows * cols - sum((width - needle.shape[1] + 1) * (height - needle.shape[0] + 1)
+                                                          for left, top, width, height in rects))
+            stats['varianceSkipped'] = float(rejectedCount) / positionCount
+
+        if rects is None:
+            # get all matches at once, credit: https://stackoverflow.com/questions/7670112/finding-a-subimage-inside-a-numpy-image/9253805#9253805
+            if compatible is not None and (flat or not compatible.any()):
+                # Nothing needs correlating: a flat needle perfectly matches the compatible windows, if there are any.
+                result = compatible.astype(numpy.float32)
+            elif needleMask is None:
+                result = cv2.matchTemplate(haystackImage, needle, cv2.TM_CCOEFF_NORMED)
+                if compatible is None:
+                    _rejectFlatWindows(result, haystackImage, needle, confidence)
+                else:
+                    result[~compatible] = 0
+            else:
+                result = _matchTemplateMasked(haystackImage, needle, needleMask)
+            if trim:
+                result = result[trimTop:trimTop + haystackImage.shape[0] - searchHeight + 1,
+                                trimLeft:trimLeft + haystackImage.shape[1] - searchWidth + 1]
+            match_indices = numpy.flatnonzero(result > confidence)[:limit]
+            matchy, matchx = numpy.unravel_index(match_indices, result.shape)
+            scores = result.ravel()[match_indices]
+            bestScore = result.max()
+        elif not rects:
+            colorMissing = True
+            continue
+        else:
+            # Only match inside the prefilter's rectangles, then put the matches in the same order a full search would.
+            resultHeight = haystackImage.shape[0] - searchHeight + 1
+            resultWidth = haystackImage.shape[1] - searchWidth + 1
+            indices, scores, bestScore = [], [], None
+            for left, top, width, height in rects:
+                window = haystackImage[top:top + height, left:left + width]
+                if compatible is not None:
+                    windowCompatible = compatible[top:top + height - needle.shape[0] + 1,
+                                                  left:left + width - needle.shape[1] + 1]
+                if flat:
+                    result = windowCompatible.astype(numpy.float32)
+                elif needleMask is None:
+                    result = cv2.matchTemplate(window, needle, cv2.TM_CCOEFF_NORMED)
+                    if compatible is None:
+                        _rejectFlatWindows(result, window, needle, confidence)
+                    else:
+                        result[~windowCompatible] = 0
+                else:
+                    result = _matchTemplateMasked(window, needle, needleMask)
+                found = numpy.flatnonzero(result > confidence)
+                foundy, foundx = numpy.unravel_index(found, result.shape)
+                foundy, foundx = foundy + top - trimTop, foundx + left - trimLeft
+                if trim:
+                    # Drop the positions where the whole needle would hang off the haystack.
+                    inside = (foundy >= 0) & (foundy < resultHeight) & (foundx >= 0) & (foundx < resultWidth)
+                    found, foundy, foundx = found[inside], foundy[inside], foundx[inside]
+                indices.append(foundy * resultWidth + foundx)
+                scores.append(result.ravel()[found])
+                bestScore = result.max() if bestScore is None else max(bestScore, result.max())
+            # The rectangles can overlap, so drop any duplicate matches.
+            match_indices, unique = numpy.unique(numpy.concatenate(indices), return_index=True)
+            match_indices = match_indices[:limit]
+            scores = numpy.concatenate(scores)[unique][:limit]
+            matchy, matchx = match_indices // resultWidth, match_indices % resultWidth
+
+        if len(match_indices) == 0:
+            highestConfidence = max(highestConfidence, bestScore) if highestConfidence is not None else bestScore
+            continue
+
+        if scales is not None:
+            _getNeedleCacheEntry(needleImage)['lastScale'] = scale
+        matches = numpy.zeros(len(match_indices), dtype=MATCH_DTYPE)
+        matches['left'] = matchx * step + region[0]  # vectorized
+        matches['top'] = matchy * step + region[1]
+        matches['width'] = needleWidth
+        matches['height'] = needleHeight
+        matches['score'] = scores
+        matches['scale'] = scale
+        matches['seconds'] = time.time() - startTime
+        return matches
+
+    if USE_IMAGE_NOT_FOUND_EXCEPTION:
+        if highestConfidence is None and colorMissing:
+            raise ImageNotFoundException('Could not locate the image (the haystack has none of its rarest color)')
+        if highestConfidence is None:
+            raise ImageNotFoundException('Could not locate the image (the needle is larger than the haystack at every scale)')
+        raise ImageNotFoundException('Could not locate the image (highest confidence = %.3f)' % highestConfidence)
+    return numpy.zeros(0, dtype=MATCH_DTYPE)
+
+
+def _locateBands_opencv(needleImage, haystackImage, grayscale, limit, region, step, confidence, method, prefilter, trim):
+    """
+    Yields a MATCH_DTYPE structured array of the matches in each band of
+    STREAM_BAND_HEIGHT rows of needle positions in the haystack (or region),
+    from top to bottom, stopping once `limit` matches have been found.
+    Together, the arrays have the same matches in the same order as
+    _locateAllArray_opencv() returns for the whole haystack, but each one
+    is yielded as soon as its band has been searched.
+
+    A haystack that the haystack cache can't keep (such as a filename or a
+    writable array) is loaded and converted once, here, as a read-only view
+    that the cache can keep, so that the bands share it and the grayscale,
+    half-size, and edge images made from it.
+    """
+    startTime = time.time()
+    needleHeight = _loadNeedle_cv2(needleImage, grayscale).shape[0]
+    if _isArrayFile(haystackImage):
+        haystackImage = _loadArrayFile(haystackImage) # each band only reads its own rows of it
+    elif not _isCacheableHaystack(haystackImage):
+        haystackImage = _load_cv2(haystackImage, grayscale or method == 'edges').view()
+        haystackImage.flags.writeable = False
+    if region:
+        left, top, width, height = region
+    else:
+        width, height = _imageSize(haystackImage)
+        left = top = 0
+
+    if height < needleHeight:
+        raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+
+    numMatchesFound = 0
+    bandTop, end = top, top + height - needleHeight + 1 # the rows of needle positions
+    while bandTop < end:
+        bandEnd = min(bandTop + STREAM_BAND_HEIGHT, end)
+        try:
+            # The band's region is just tall enough for the needle positions in the band.
+            matches = _locateAllArray_opencv(needleImage, haystackImage, grayscale, limit - numMatchesFound,
+                                             (left, bandTop, width, bandEnd - bandTop + needleHeight - 1),
+                                             step, confidence, None, method, prefilter, trim)
+        except ImageNotFoundException:
+            matches = numpy.zeros(0, dtype=MATCH_DTYPE)
+        # With step=2, the band can also match at the next band's first row, which that band will find.
+        matches = matches[matches['top'] < bandEnd]
+        matches['seconds'] = time.time() - startTime
+        numMatchesFound += len(matches)
+        yield matches
+        if numMatchesFound >= limit:
+            return
+        bandTop = bandEnd
+
+    if numMatchesFound == 0 and USE_IMAGE_NOT_FOUND_EXCEPTION:
+        raise ImageNotFoundException('Could not locate the image.')
+
+
 def _locateAll_opencv(needleImage, haystackImage, grayscale=None, limit=10000, region=None, step=1,
-                      confidence=0.999):
+                      confidence=None, scales=None, method=None, prefilter=False, trim=False, stream=False,
+                      withScores=False):
     """
     TODO - rewrite this
         faster but more memory-intensive than pure python
         step 2 skips every other row and column = ~3x faster but prone to miss;
             to compensate, the algorithm automatically reduces the confidence
             threshold by 5% (which helps but will not avoid all misses).
+        transparent needle pixels (from the needle's alpha channel) are
+            ignored, so one transparent needle matches on any background.
+        scales is a list of factors to resize the needle by (or 'auto' for
+            AUTO_SCALES), for when the haystack was rendered at a different
+            zoom level. The scales are tried in order, except that the scale
+            this needle was last found at is tried first, and the search stops
+            at the first scale with any matches. The matches are ScaledBox
+            tuples that include the scale they were found at, so that later
+            calls can pass scales=[box.scale] to pin it.
+        method='edges' matches the images' edge maps (see EDGE_THRESHOLDS)
+            instead of their colors, which finds the needle after a change
+            of theme or highlight that keeps its outlines, such as dark text
+            on a light background becoming light text on a dark one. The
+            edge maps are cached like the needle and haystack images are.
+            It's less exact, so it usually needs a lower confidence, and the
+            grayscale, step, prefilter, and trim arguments don't apply to
+            it.
+        method='features' matches keypoints instead of pixels, which finds
+            a rotated or distorted needle. See _locateFeatures_opencv().
+            The confidence, scales, and step arguments don't apply to it.
+        prefilter=True only matches around the haystack pixels that have
+            the needle's rarest color (with 4 bits per channel), and reports
+            the fraction of the haystack it skipped in getLastLocateStats().
+            It finds the same matches when that color shows up unchanged
+            wherever the needle does, which isn't the case for a scaled or
+            blurry needle. When the color is too common to skip much, the
+            whole haystack is searched.
+        Windows whose variance rules out a match aren't correlated with
+            the needle at all (see VARIANCE_MIN_RATIO), which saves the most
+            time on screens with large flat areas. The fraction of needle
+            positions skipped is reported in getLastLocateStats(). Needles
+            with transparent pixels are always correlated everywhere.
+        trim=True matches only the needle's core, without the rows and
+            columns of flat background (or transparent pixels) around it,
+            which is faster and ignores whatever surrounds the needle in the
+            haystack. The matches still have the whole needle's position and
+            size, and only ones where the whole needle fits in the haystack
+            are reported. See _trimNeedle_cv2().
+        stream=True searches the haystack a band of rows at a time, from
+            top to bottom, and yields each band's matches before searching
+            the next one, so a caller that stops at the first match doesn't
+            wait for the whole haystack to be searched. The matches are the
+            same. It's ignored with scales or method='features'. See
+            _locateBands_opencv().
+        withScores=True yields Match tuples instead, which also have the
+            match's score (its correlation with the needle), its scale, and
+            the number of seconds the search took.
+        confidence=None uses the confidence that calibrateConfidence()
+            saved for the needle file, or DEFAULT_CONFIDENCE.
         limitations:
           - OpenCV 3.x & python 3.x not tested
-          - RGBA images are treated as RBG (ignores alpha channel)
+          - RGBA haystacks are treated as RGB (ignores alpha channel)
     """
-    if grayscale is None:
-        grayscale = GRAYSCALE_DEFAULT
+    if stream and scales is None and method != 'features':
+        if grayscale is None:
+            grayscale = GRAYSCALE_DEFAULT
+        bands = _locateBands_opencv(needleImage, haystackImage, grayscale, limit, region, step, confidence, method,
+                                    prefilter, trim)
+    else:
+        bands = [_locateAllArray_opencv(needleImage, haystackImage, grayscale, limit, region, step, confidence, scales,
+                                        method, prefilter, trim)]
 
-    confidence = float(confidence)
+    # use a generator for API consistency:
+    for matches in bands:
+        if withScores:
+            for match in matches.tolist():
+                yield Match(*match)
+        elif scales is not None and method != 'features':
+            for left, top, width, height, scale in zip(matches['left'].tolist(), matches['top'].tolist(),
+                                                      matches['width'].tolist(), matches['height'].tolist(),
+                                                      matches['scale'].tolist()):
+                yield ScaledBox(left, top, width, height, scale)
+        else:
+            for left, top, width, height in zip(matches['left'].tolist(), matches['top'].tolist(),
+                                                matches['width'].tolist(), matches['height'].tolist()):
+                yield Box(left, top, width, height)
 
-    needleImage = _load_cv2(needleImage, grayscale)
-    needleHeight, needleWidth = needleImage.shape[:2]
-    haystackImage = _load_cv2(haystackImage, grayscale)
 
-    if region:
-        haystackImage = haystackImage[region[1]:region[1]+region[3],
-                                      region[0]:region[0]+region[2]]
-    else:
-        region = (0, 0)  # full image; these values used in the yield statement
-    if (haystackImage.shape[0] < needleImage.shape[0] or
-        haystackImage.shape[1] < needleImage.shape[1]):
-        # avoid semi-cryptic OpenCV error below if bad size
-        raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+def _nextFastLength(n):
+    """
+    Returns the smallest number that is at least `n` and has no prime
+    factors other than 2, 3, and 5. NumPy's FFT is much faster for these.
+    """
+    best = 1
+    while best < n:
+        best *= 2
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def _windowSums(array, height, width):
+    """
+    Returns an array of the sums of every `height` x `width` window of the 2D
+    integer `array`, using an integral image so that each sum takes four
+    lookups no matter how big the window is.
+    """
+    integral = numpy.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=numpy.int64)
+    numpy.cumsum(numpy.cumsum(array, axis=0, dtype=numpy.int64), axis=1, out=integral[1:, 1:])
+    return integral[height:, width:] - integral[:-height, width:] - integral[height:, :-width] + integral[:-height, :-width]
+
+
+def _fftIsCheaper(needleShape, haystackShape, fraction=1.0):
+    """
+    Returns True if correlating a needle with a haystack is estimated to be
+    faster with FFTs than by summing the shifted haystack once per needle
+    pixel, at `fraction` of the haystack's positions. The direct approach
+    costs about one multiply-add per needle pixel per position, while the
+    FFTs cost about log2 of the transform size per position of the whole
+    haystack no matter how big the needle is. The constant was measured
+    with numpy's FFT against numpy's array arithmetic.
+    """
+    fftLength = _nextFastLength(haystackShape[0]) * _nextFastLength(haystackShape[1])
+    return needleShape[0] * needleShape[1] * fraction > 0.5 * log(fftLength, 2)
+
 
-    if step == 2:
-        confidence *= 0.95
-        needleImage = needleImage[::step, ::step]
-        haystackImage = haystackImage[::step, ::step]
+def _matchTemplate_numpy(needleArray, haystackArray, needleEntry=None, haystackEntry=None, stats=None):
+    """
+    Returns an array of the normalized correlation coefficient (the same
+    score as OpenCV's TM_CCOEFF_NORMED) between the needle and every
+    needle-sized window of the haystack, using only NumPy. Both arrays must
+    be uint8, either 2D (grayscale) or 3D with the same number of channels.
+
+    The correlation is done with FFTs if _fftIsCheaper() says so. The
+    needle's spectrum is kept in `needleEntry` (from the needle cache) and
+    the haystack's spectrum and window sums in `haystackEntry` (from the
+    haystack cache), keyed by size, so that repeated searches only transform
+    what they haven't seen before.
+
+    Only the windows whose variance is compatible with the needle's (see
+    VARIANCE_MIN_RATIO) need to be correlated, and the fraction of the
+    windows that weren't correlated at all is put in `stats` as
+    'varianceSkipped'.
+    """
+    if needleEntry is None:
+        needleEntry = {}
+    if haystackEntry is None:
+        haystackEntry = {}
+    if needleArray.ndim == 2:
+        needleArray = needleArray[:, :, numpy.newaxis]
+    if haystackArray.ndim == 2:
+        haystackArray = haystackArray[:, :, numpy.newaxis]
+
+    needleHeight, needleWidth, channels = needleArray.shape
+    haystackHeight, haystackWidth = haystackArray.shape[:2]
+    rows, cols = haystackHeight - needleHeight + 1, haystackWidth - needleWidth + 1
+    needleArea = needleHeight * needleWidth
+
+    if 'moments' not in needleEntry:
+        needleEntry['moments'] = _needleMoments(needleArray)
+    needleMean, needleNormSquared = needleEntry['moments']
+    needleCentered = needleArray - needleMean # subtracting the mean means the haystack's mean doesn't need to be
+
+    # The sum and the needle-area-times-variance of every window. The variance is exact,
+    # since it's calculated with integers, so flat windows have a variance of exactly 0.
+    key = ('windowSums', needleHeight, needleWidth)
+    if key not in haystackEntry:
+        windowSums = []
+        windowVariances = numpy.zeros((rows, cols), dtype=numpy.int64)
+        for channel in range(channels):
+            plane = haystackArray[:, :, channel].astype(numpy.int64)
+            sums = _windowSums(plane, needleHeight, needleWidth)
+            windowVariances += _windowSums(plane * plane, needleHeight, needleWidth) * needleArea - sums * sums
+            windowSums.append(sums)
+        haystackEntry[key] = (windowSums, windowVariances)
+    windowSums, windowVariances = haystackEntry[key]
+
+    scores = numpy.zeros((rows, cols))
+    textured = windowVariances > 0
+    if needleNormSquared == 0:
+        # A flat needle only matches flat windows of the same color.
+        compatible = ~textured
+        for channel in range(channels):
+            compatible &= numpy.abs(windowSums[channel] / float(needleArea) - needleMean[channel]) < 0.5
+        scores[compatible] = 1.0
     else:
-        step = 1
+        compatible = textured & (windowVariances >= VARIANCE_MIN_RATIO * needleNormSquared * needleArea)
+    if stats is not None:
+        stats['varianceSkipped'] = 1.0 - float(numpy.count_nonzero(compatible)) / compatible.size
+    if needleNormSquared == 0 or not compatible.any():
+        return scores
+
+    matchYs, matchXs = numpy.nonzero(compatible)
+    if _fftIsCheaper(needleArray.shape, haystackArray.shape, len(matchYs) / float(compatible.size)):
+        fftShape = (_nextFastLength(haystackHeight), _nextFastLength(haystackWidth))
+        key = ('spectrum', fftShape)
+        if key not in needleEntry:
+            # Correlating is convolving with the needle flipped both ways.
+            needleEntry[key] = numpy.fft.rfft2(needleCentered[::-1, ::-1], s=fftShape, axes=(0, 1))
+        if key not in haystackEntry:
+            haystackEntry[key] = numpy.fft.rfft2(haystackArray, s=fftShape, axes=(0, 1))
+        # Adding up the channels before the inverse transform means only one inverse transform is needed.
+        correlation = numpy.fft.irfft2((needleEntry[key] * haystackEntry[key]).sum(axis=2), s=fftShape)
+        numerator = correlation[needleHeight - 1 + matchYs, needleWidth - 1 + matchXs]
+        if stats is not None:
+            stats['varianceSkipped'] = 0.0 # the transforms correlate every window
+    elif len(matchYs) > compatible.size // 2:
+        # Shifting whole slices is faster than gathering most of the positions one by one.
+        numerator = numpy.zeros((rows, cols))
+        for y in range(needleHeight):
+            for x in range(needleWidth):
+                numerator += numpy.dot(haystackArray[y:y + rows, x:x + cols], needleCentered[y, x])
+        numerator = numerator[matchYs, matchXs]
+        if stats is not None:
+            stats['varianceSkipped'] = 0.0
+    else:
+        # Only sum the needle pixels' products at the compatible positions.
+        numerator = numpy.zeros(len(matchYs))
+        for y in range(needleHeight):
+            for x in range(needleWidth):
+                numerator += numpy.dot(haystackArray[matchYs + y, matchXs + x], needleCentered[y, x])
 
-    # get all matches at once, credit: https://stackoverflow.com/questions/7670112/finding-a-subimage-inside-a-numpy-image/9253805#9253805
-    result = cv2.matchTemplate(haystackImage, needleImage, cv2.TM_CCOEFF_NORMED)
-    match_indices = numpy.arange(result.size)[(result > confidence).flatten()]
-    matches = numpy.unravel_index(match_indices[:limit], result.shape)
+    scores[matchYs, matchXs] = numerator / numpy.sqrt(needleNormSquared * windowVariances[matchYs, matchXs] / needleArea)
+    return scores
 
-    if len(matches[0]) == 0:
-        if USE_IMAGE_NOT_FOUND_EXCEPTION:
-            raise ImageNotFoundException('Could not locate the image (highest confidence = %.3f)' % result.max())
-        else:
-            return
 
-    # use a generator for API consistency:
-    matchx = matches[1] * step + region[0]  # vectorized
-    matchy = matches[0] * step + region[1]
-    for x, y in zip(matchx, matchy):
-        yield Box(x, y, needleWidth, needleHeight)
+def _confidenceFind(needleArray, haystackArray, confidence, needleEntry, haystackEntry, stats=None):
+    """
+    Yields the (x, y, score) of every position where the needle's score from
+    _matchTemplate_numpy() is above `confidence`, from left to right and then
+    top to bottom. If there are none and USE_IMAGE_NOT_FOUND_EXCEPTION is
+    True, raises ImageNotFoundException with the highest score.
+    """
+    if needleArray.ndim != haystackArray.ndim:
+        return # one image is grayscale and the other isn't
+    if haystackArray.shape[0] < needleArray.shape[0] or haystackArray.shape[1] < needleArray.shape[1]:
+        raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+
+    scores = _matchTemplate_numpy(needleArray, haystackArray, needleEntry, haystackEntry, stats)
+    matchYs, matchXs = numpy.nonzero(scores > confidence)
+    if len(matchYs) == 0 and USE_IMAGE_NOT_FOUND_EXCEPTION:
+        raise ImageNotFoundException('Could not locate the image (highest confidence = %.3f)' % scores.max())
+    for x, y, score in zip(matchXs.tolist(), matchYs.tolist(), scores[matchYs, matchXs].tolist()):
+        yield x, y, score
 
 
 # TODO - We should consider renaming _locateAll_python to _locateAll_pillow, since Pillow is the real dependency.
 @requiresPillow
-def _locateAll_python(needleImage, haystackImage, grayscale=None, limit=None, region=None, step=1, confidence=None):
+def _locateAll_python(needleImage, haystackImage, grayscale=None, limit=None, region=None, step=1, confidence=None,
+                      scales=None, method=None, prefilter=False, trim=False, stream=False, withScores=False):
     """
     TODO
     """
-    if confidence is not None:
-        raise NotImplementedError('The confidence keyword argument is only available if OpenCV is installed.')
+    startTime = time.time()
+    stats = _locateStats.last = {}
+    if confidence is not None and _NUMPY_UNAVAILABLE:
+        raise NotImplementedError('The confidence keyword argument is only available if OpenCV or NumPy is installed.')
+    if scales is not None:
+        raise NotImplementedError('The scales keyword argument is only available if OpenCV is installed.')
+    if method not in (None, 'template'):
+        raise NotImplementedError('Only method=\'template\' is available if OpenCV isn\'t installed.')
+    if prefilter:
+        raise NotImplementedError('The prefilter keyword argument is only available if OpenCV is installed.')
+    if trim:
+        raise NotImplementedError('The trim keyword argument is only available if OpenCV is installed.')
 
     # setup all the arguments
     if grayscale is None:
         grayscale = GRAYSCALE_DEFAULT
 
-    needleFileObj = None
-    if isinstance(needleImage, (str, unicode)):
-        # 'image' is a filename, load the Image object
-        needleFileObj = open(needleImage, 'rb')
-        needleImage = Image.open(needleFileObj)
+    needleEntry = _getNeedleCacheEntry(needleImage)
+    haystackEntry = _getHaystackCacheEntry(haystackImage)
+    needleImage = _loadNeedle_pillow(needleImage, grayscale)
 
-    haystackFileObj = None
-    if isinstance(haystackImage, (str, unicode)):
-        # 'image' is a filename, load the Image object
-        haystackFileObj = open(haystackImage, 'rb')
-        haystackImage = Image.open(haystackFileObj)
+    if _isArrayFile(haystackImage):
+        haystackImage = _loadArrayFile(haystackImage)
+    elif _isEmbeddedImage(haystackImage):
+        haystackImage = _loadEmbeddedImage(haystackImage)
+    elif isinstance(haystackImage, (str, unicode)):
+        # 'image' is a filename, load the Image object. Pillow closes the file once it has read the pixels.
+        haystackImage = Image.open(haystackImage)
 
-    if region is not None:
-        haystackImage = haystackImage.crop((region[0], region[1], region[0] + region[2], region[1] + region[3]))
+    if not _NUMPY_UNAVAILABLE and isinstance(haystackImage, numpy.ndarray):
+        # Crop before converting, so that only the region of a memory-mapped image is read.
+        if region is not None:
+            haystackImage = haystackImage[region[1]:region[1] + region[3], region[0]:region[0] + region[2]]
+        haystackImage = _loadHaystack_pillow(_arrayToImage(haystackImage), grayscale)
     else:
+        # if grayscale mode is on, convert the haystack image to grayscale (the needle already is)
+        haystackImage = _loadHaystack_pillow(haystackImage, grayscale)
+        if region is not None:
+            haystackImage = haystackImage.crop((region[0], region[1], region[0] + region[2], region[1] + region[3]))
+    if region is None:
         region = (0, 0) # set to 0 because the code always accounts for a region
 
-    if grayscale: # if grayscale mode is on, convert the needle and haystack images to grayscale
-        needleImage = ImageOps.grayscale(needleImage)
-        haystackImage = ImageOps.grayscale(haystackImage)
-    else:
-        # if not using grayscale, make sure we are comparing RGB images, not RGBA images.
-        if needleImage.mode == 'RGBA':
-            needleImage = needleImage.convert('RGB')
-        if haystackImage.mode == 'RGBA':
-            haystackImage = haystackImage.convert('RGB')
-
     # setup some constants we'll be using in this function
     needleWidth, needleHeight = needleImage.size
-    haystackWidth, haystackHeight = haystackImage.size
-
-    needleImageData = tuple(needleImage.getdata())
-    haystackImageData = tuple(haystackImage.getdata())
-
-    needleImageRows = [needleImageData[y * needleWidth:(y+1) * needleWidth] for y in range(needleHeight)] # LEFT OFF - check this
-    needleImageFirstRow = needleImageRows[0]
-
-    assert len(needleImageFirstRow) == needleWidth, 'For some reason, the calculated width of first row of the needle image is not the same as the width of the image.'
-    assert [len(row) for row in needleImageRows] == [needleWidth] * needleHeight, 'For some reason, the needleImageRows aren\'t the same size as the original image.'
 
-    numMatchesFound = 0
-
-    # NOTE: After running tests/benchmarks.py on the following code, it seem that having a step
-    # value greater than 1 does not give *any* significant performance improvements.
-    # Since using a step higher than 1 makes for less accurate matches, it will be
-    # set to 1.
-    step = 1 # hard-code step as 1 until a way to improve it can be figured out.
-
-    if step == 1:
-        firstFindFunc = _kmp
+    if confidence is not None:
+        # The haystack cache entry is shared by searches of any region, so the region is part of its keys.
+        haystackEntry = haystackEntry.setdefault(('region', tuple(region), bool(grayscale)), {})
+        positions = _confidenceFind(numpy.asarray(needleImage), numpy.asarray(haystackImage), float(confidence),
+                                    needleEntry.setdefault(('numpy', bool(grayscale)), {}), haystackEntry, stats)
+    elif not _NUMPY_UNAVAILABLE:
+        # Exact matches always have a perfect score. Every position is compared either way, and comparing the
+        # rarest colors first rules out more of them than every step-th pixel does, so the step is ignored.
+        positions = ((x, y, 1.0) for x, y in _exactFind(numpy.asarray(needleImage), numpy.asarray(haystackImage),
+                                                        needleEntry.setdefault(('numpy', bool(grayscale)), {}), stats))
     else:
-        firstFindFunc = _steppingFind
+        # Without NumPy, a step higher than 1 gives no significant performance improvement, so it's ignored.
+        positions = ((x, y, 1.0) for x, y in _rowFind(needleImage, haystackImage))
 
-
-    for y in range(haystackHeight): # start at the leftmost column
-        for matchx in firstFindFunc(needleImageFirstRow, haystackImageData[y * haystackWidth:(y+1) * haystackWidth], step):
-            foundMatch = True
-            for searchy in range(1, needleHeight, step):
-                haystackStart = (searchy + y) * haystackWidth + matchx
-                if needleImageData[searchy * needleWidth:(searchy+1) * needleWidth] != haystackImageData[haystackStart:haystackStart + needleWidth]:
-                    foundMatch = False
-                    break
-            if foundMatch:
-                # Match found, report the x, y, width, height of where the matching region is in haystack.
-                numMatchesFound += 1
-                yield Box(matchx + region[0], y + region[1], needleWidth, needleHeight)
-                if limit is not None and numMatchesFound >= limit:
-                    # Limit has been reached. Close file handles.
-                    if needleFileObj is not None:
-                        needleFileObj.close()
-                    if haystackFileObj is not None:
-                        haystackFileObj.close()
-                    return
-
-
-    # There was no limit or the limit wasn't reached, but close the file handles anyway.
-    if needleFileObj is not None:
-        needleFileObj.close()
-    if haystackFileObj is not None:
-        haystackFileObj.close()
+    numMatchesFound = 0
+    for matchx, y, score in positions:
+        # Match found, report the x, y, width, height of where the matching region is in haystack.
+        numMatchesFound += 1
+        if withScores:
+            yield Match(matchx + region[0], y + region[1], needleWidth, needleHeight, score, 1.0, time.time() - startTime)
+        else:
+            yield Box(matchx + region[0], y + region[1], needleWidth, needleHeight)
+        if limit is not None and numMatchesFound >= limit:
+            return
 
     if numMatchesFound == 0:
         if USE_IMAGE_NOT_FOUND_EXCEPTION:
@@ -346,39 +1909,650 @@ def locate(needleImage, haystackImage, **kwargs):
             return None
 
 
+@requiresNumpy
+def locateAllArray(needleImage, haystackImage, **kwargs):
+    """
+    Like locateAll(), but returns every match at once as a numpy structured
+    array with the MATCH_DTYPE fields (left, top, width, height, score,
+    scale, and seconds) instead of a generator of Box tuples. With OpenCV,
+    this avoids creating a tuple for each match, which matters for needles
+    that match thousands of times. Use array['left'] and so on to get each
+    field as an array. The `stream` and `withScores` keyword arguments are
+    accepted but make no difference, since the array has every match's
+    score and is returned all at once.
+    """
+    if locateAll is _locateAll_opencv:
+        kwargs.pop('stream', None)
+        kwargs.pop('withScores', None)
+        return _locateAllArray_opencv(needleImage, haystackImage, **kwargs)
+    kwargs['withScores'] = True
+    return numpy.array([tuple(match) for match in locateAll(needleImage, haystackImage, **kwargs)], dtype=MATCH_DTYPE)
+
+
+def _bestCandidates(result, needleWidth, needleHeight, count):
+    """
+    Returns the (x, y, score) tuples of the `count` highest scores in the
+    matchTemplate result `result`, best first, where each one is at least a
+    needle's width or height away from the ones before it, so that a single
+    match doesn't fill every slot with its neighbors.
+    """
+    result = result.copy()
+    candidates = []
+    for i in range(count):
+        y, x = numpy.unravel_index(numpy.argmax(result), result.shape)
+        score = float(result[y, x])
+        if score == -numpy.inf:
+            break
+        candidates.append((int(x), int(y), score))
+        result[max(0, y - needleHeight + 1):y + needleHeight, max(0, x - needleWidth + 1):x + needleWidth] = -numpy.inf
+    return candidates
+
+
+def _maxPool(result, size):
+    """
+    Returns the matchTemplate result `result` shrunk to at most `size` cells
+    wide and tall, where each cell holds the highest score in the square of
+    scores it covers, along with the width of that square.
+    """
+    cellSize = max(1, -(-max(result.shape) // size))
+    height, width = -(-result.shape[0] // cellSize), -(-result.shape[1] // cellSize)
+    padded = numpy.full((height * cellSize, width * cellSize), -1.0, dtype=numpy.float32)
+    padded[:result.shape[0], :result.shape[1]] = result
+    return padded.reshape(height, cellSize, width, cellSize).max(axis=(1, 3)), cellSize
+
+
+@requiresOpenCV
+def explainLocate(needleImage, haystackImage, grayscale=None, region=None, confidence=None,
+                  candidates=EXPLAIN_CANDIDATES):
+    """
+    Explains why locate() does or doesn't find needleImage in haystackImage,
+    for when a needle can't be found and it isn't clear why. Returns a dict
+    with:
+
+    - 'found': whether locate() would find the needle with these arguments.
+    - 'bestScore': the highest score anywhere in the haystack.
+    - 'candidates': Match tuples for the best places the needle could be,
+      best first, which are at least a needle's size apart.
+    - 'heatmap' and 'heatmapCellSize': a numpy array of scores, where each
+      cell is the highest score of a heatmapCellSize x heatmapCellSize
+      square of needle positions. Its top-left cell is at the region's
+      top-left corner.
+    - 'lowerConfidence': the highest confidence that would have found the
+      needle, or None if it was found.
+    - 'grayscaleScore' and 'grayscaleWouldMatch': the best grayscale score
+      of the candidates, and whether it beats the confidence. For a
+      grayscale search, these are the same as the color ones.
+    - 'varianceSkipped': the fraction of needle positions that locate()
+      rules out by their variance (see VARIANCE_MIN_RATIO), which score 0
+      here too, or None for a needle with transparent pixels.
+    - 'timings': the seconds spent on each stage: 'load' (the needle),
+      'convert' (the haystack), 'match', and 'threshold'.
+
+    The haystack is only searched once. The grayscale score is only worked
+    out at the candidates, so a grayscale match elsewhere isn't noticed.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    if confidence is None:
+        confidence = _calibratedConfidence(needleImage, grayscale)
+    confidence = float(confidence)
+    timings = {}
+
+    startTime = time.time()
+    needle, needleMask = _loadScaledNeedle_cv2(needleImage, grayscale, 1.0)
+    needleHeight, needleWidth = needle.shape[:2]
+    timings['load'] = time.time() - startTime
+
+    startTime = time.time()
+    frame = haystackImage
+    haystackImage = _loadHaystack_cv2(frame, grayscale)
+    if region:
+        haystackImage = haystackImage[region[1]:region[1]+region[3], region[0]:region[0]+region[2]]
+    else:
+        region = (0, 0)
+    if haystackImage.shape[0] < needleHeight or haystackImage.shape[1] < needleWidth:
+        raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+    timings['convert'] = time.time() - startTime
+
+    startTime = time.time()
+    varianceSkipped = None
+    if needleMask is None:
+        # Score the positions the same way _locateAllArray_opencv() does.
+        compatible, flat = _compatibleWindows(haystackImage, needle)
+        varianceSkipped = 1.0 - float(numpy.count_nonzero(compatible)) / compatible.size
+        if flat:
+            result = compatible.astype(numpy.float32)
+        else:
+            result = cv2.matchTemplate(haystackImage, needle, cv2.TM_CCOEFF_NORMED)
+            result[~compatible] = 0
+    else:
+        result = _matchTemplateMasked(haystackImage, needle, needleMask)
+    timings['match'] = time.time() - startTime
+
+    startTime = time.time()
+    bestScore = float(result.max())
+    found = bool(bestScore > confidence)
+    best = _bestCandidates(result, needleWidth, needleHeight, candidates)
+    heatmap, cellSize = _maxPool(result, EXPLAIN_HEATMAP_SIZE)
+    timings['threshold'] = time.time() - startTime
+
+    if grayscale:
+        grayscaleScore = bestScore
+    else:
+        # Score just the candidates in grayscale, rather than searching the whole haystack again.
+        grayNeedle = _loadNeedle_cv2(needleImage, True)
+        grayHaystack = _loadHaystack_cv2(frame, True)[region[1]:, region[0]:]
+        grayscaleScore = None
+        for x, y, score in best:
+            window = grayHaystack[y:y + needleHeight, x:x + needleWidth]
+            if needleMask is None:
+                compatible, flat = _compatibleWindows(window, grayNeedle)
+                if flat or not compatible[0, 0]:
+                    score = compatible[0, 0]
+                else:
+                    score = cv2.matchTemplate(window, grayNeedle, cv2.TM_CCOEFF_NORMED)[0, 0]
+            else:
+                score = _matchTemplateMasked(window, grayNeedle, needleMask)[0, 0]
+            grayscaleScore = float(score) if grayscaleScore is None else max(grayscaleScore, float(score))
+
+    lowerConfidence = None
+    if not found:
+        # Matches must score above the confidence, so round down to three decimal places.
+        lowerConfidence = (int(numpy.ceil(bestScore * 1000)) - 1) / 1000.0
+
+    return {'found': found,
+            'bestScore': bestScore,
+            'candidates': [Match(x + region[0], y + region[1], needleWidth, needleHeight, score, 1.0, sum(timings.values()))
+                           for x, y, score in best],
+            'heatmap': heatmap,
+            'heatmapCellSize': cellSize,
+            'lowerConfidence': lowerConfidence,
+            'grayscaleScore': grayscaleScore,
+            'grayscaleWouldMatch': grayscaleScore is not None and grayscaleScore > confidence,
+            'varianceSkipped': varianceSkipped,
+            'timings': timings}
+
+
+_calibrationLock = threading.Lock()
+
+
+def _calibrationFilename(needleFilename):
+    """
+    Returns the filename of the calibration file for the needle file.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(needleFilename)), CALIBRATION_FILENAME)
+
+
+def _calibrationRecord(needleFilename):
+    """
+    Returns the dict that identifies the contents of the needle file in its
+    calibration file, so that a confidence calibrated for an earlier
+    version of the file isn't used.
+    """
+    with open(needleFilename, 'rb') as needleFile:
+        data = needleFile.read()
+    return {'size': len(data), 'crc32': zlib.crc32(data) & 0xffffffff}
+
+
+def _readCalibrations(calibrationFilename):
+    """
+    Returns the dict of needle file names to calibration records in the
+    calibration file, or an empty dict if there isn't one.
+    """
+    try:
+        with open(calibrationFilename) as calibrationFile:
+            return json.load(calibrationFile)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _calibratedConfidence(needleImage, grayscale):
+    """
+    Returns the confidence that calibrateConfidence() saved for the needle
+    file `needleImage` and grayscale setting, or DEFAULT_CONFIDENCE if it
+    hasn't been calibrated (or isn't a file). The calibration file is only
+    read once per needle, since the result is kept in the needle cache.
+    """
+    if not isinstance(needleImage, (str, unicode)) or needleImage.startswith(ATLAS_PREFIX):
+        return DEFAULT_CONFIDENCE
+    entry = _getNeedleCacheEntry(needleImage)
+    key = ('confidence', bool(grayscale))
+    if key not in entry:
+        confidence = None
+        try:
+            record = _readCalibrations(_calibrationFilename(needleImage)).get(os.path.basename(needleImage))
+            if record is not None and record.get('file') == _calibrationRecord(needleImage):
+                confidence = record.get('grayscale' if grayscale else 'color')
+        except (IOError, OSError):
+            pass # let the loader raise its usual error about the missing file
+        entry[key] = confidence
+    if entry[key] is None:
+        return DEFAULT_CONFIDENCE
+    return entry[key]
+
+
+@requiresOpenCV
+def calibrateConfidence(needleImage, sampleHaystacks, grayscale=None, save=True):
+    """
+    Works out the confidence to locate needleImage with, from the
+    `sampleHaystacks` images, each of which must contain the needle. In each
+    one, the needle's best score (where it matches itself) is compared with
+    the best score elsewhere, at least a needle's size away. Returns the
+    confidence halfway between the lowest self-match score and the highest
+    score elsewhere, which finds the needle in every sample and nothing else.
+
+    If `save` is True and the needle is a file, the confidence is saved in
+    the CALIBRATION_FILENAME file in the needle's directory, along with the
+    needle file's size and CRC-32. The OpenCV locate functions then use it
+    whenever they're called without a confidence, until the needle file
+    changes. Raises PyScreezeException if the needle scores as well
+    somewhere else as it does where it is.
+    """
+    if grayscale is None:
+        grayscale = GRAYSCALE_DEFAULT
+    needle, needleMask = _loadScaledNeedle_cv2(needleImage, grayscale, 1.0)
+    needleHeight, needleWidth = needle.shape[:2]
+
+    selfScores, otherScores = [], []
+    for haystackImage in sampleHaystacks:
+        haystackImage = _loadHaystack_cv2(haystackImage, grayscale)
+        if haystackImage.shape[0] < needleHeight or haystackImage.shape[1] < needleWidth:
+            raise ValueError('needle dimension(s) exceed the haystack image or region dimensions')
+        if needleMask is None:
+            result = cv2.matchTemplate(haystackImage, needle, cv2.TM_CCOEFF_NORMED)
+        else:
+            result = _matchTemplateMasked(haystackImage, needle, needleMask)
+        best = _bestCandidates(result, needleWidth, needleHeight, 2)
+        selfScores.append(best[0][2])
+        otherScores.append(best[1][2] if len(best) > 1 else -1.0)
+    if not selfScores:
+        raise ValueError('at least one sample haystack is needed')
+
+    lowestSelfScore, highestOtherScore = min(selfScores), max(otherScores)
+    if lowestSelfScore <= highestOtherScore:
+        raise PyScreezeException('The needle scores %.3f somewhere else in the sample haystacks, but only %.3f where it is.'
+                                 % (highestOtherScore, lowestSelfScore))
+    confidence = (lowestSelfScore + highestOtherScore) / 2.0
+
+    if save and isinstance(needleImage, (str, unicode)) and not needleImage.startswith(ATLAS_PREFIX):
+        calibrationFilename = _calibrationFilename(needleImage)
+        with _calibrationLock:
+            calibrations = _readCalibrations(calibrationFilename)
+            record = calibrations.get(os.path.basename(needleImage), {})
+            fileRecord = _calibrationRecord(needleImage)
+            if record.get('file') != fileRecord:
+                record = {'file': fileRecord} # the other grayscale setting's confidence is for an older version of the file
+            record['grayscale' if grayscale else 'color'] = confidence
+            calibrations[os.path.basename(needleImage)] = record
+            with open(calibrationFilename, 'w') as calibrationFile:
+                json.dump(calibrations, calibrationFile, indent=2, sort_keys=True)
+        _getNeedleCacheEntry(needleImage)[('confidence', bool(grayscale))] = confidence
+        # The remembered results were found with the old confidence.
+        invalidateLocateCache()
+        with _dirtyStatesLock:
+            _dirtyStates.clear()
+    return confidence
+
+
+_resultCache = collections.OrderedDict()
+_resultCacheLock = threading.Lock()
+
+
+def _frameFingerprint(img):
+    """
+    Returns a hashable fingerprint of the pixels in the PIL image or numpy
+    array `img`, which is the same for any two images with identical pixels.
+    It's remembered in the haystack cache, so it's only computed once per
+    screenshot.
+    """
+    entry = _getHaystackCacheEntry(img)
+    if 'fingerprint' not in entry:
+        if not _NUMPY_UNAVAILABLE and isinstance(img, numpy.ndarray):
+            digest = hashlib.sha1(numpy.ascontiguousarray(img)).digest()
+            entry['fingerprint'] = (img.dtype.str, img.shape, digest)
+        else:
+            # assume its a PIL.Image
+            entry['fingerprint'] = (img.mode, img.size, hashlib.sha1(img.tobytes()).digest())
+    return entry['fingerprint']
+
+
+def _freeze(value):
+    """
+    Returns `value` with any lists (such as a scales argument) turned into
+    tuples, so that it can be part of a dict key.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+# Notified by invalidateLocateCache() so that waiting functions can look at the screen again
+# right away. _inputCount tells them whether it was notified while they weren't waiting.
+_screenChanged = threading.Condition()
+_inputCount = 0
+
+
+def invalidateLocateCache():
+    """
+    Discards the remembered locateOnScreen() and locateAllOnScreen()
+    results, and wakes up any waitForImage() and waitForImageToVanish()
+    calls to check the screen again. PyGB calls this after every mouse and
+    keyboard action, since they usually change what's on the screen, so the
+    remembered results are unlikely to be needed again.
+    """
+    global _inputCount
+    with _resultCacheLock:
+        _resultCache.clear()
+    with _screenChanged:
+        _inputCount += 1
+        _screenChanged.notify_all()
+
+
+_tileWeights = {}
+_dirtyStates = collections.OrderedDict()
+_dirtyStatesLock = threading.Lock()
+
+
+def _tileHashes(img):
+    """
+    Returns a 2D array of a hash of each DIRTY_TILE_SIZE x DIRTY_TILE_SIZE
+    tile of the PIL image or uint8 numpy array `img`, which is remembered in
+    the haystack cache. The hash is a weighted sum of the tile's pixels with
+    random odd 64-bit weights, so it's computed with a few vectorized
+    operations over the whole image.
+    """
+    entry = _getHaystackCacheEntry(img)
+    if 'tileHashes' not in entry:
+        array = numpy.asarray(img)
+        if array.dtype != numpy.uint8:
+            raise TypeError('only images with 8-bit channels can be hashed')
+        if array.ndim == 2:
+            array = array[:, :, numpy.newaxis]
+        height, width, channels = array.shape
+        size = DIRTY_TILE_SIZE
+        rows, cols = -(-height // size), -(-width // size)
+        padded = numpy.zeros((rows * size, cols * size, channels), dtype=numpy.uint8)
+        padded[:height, :width] = array
+        # Each row of a tile is size * channels bytes, which is a whole number of 64-bit words.
+        words = padded.reshape(rows * size, -1).view(numpy.uint64).reshape(rows, size, cols, -1)
+        if words.shape[1:] not in _tileWeights:
+            weights = numpy.random.RandomState(channels).randint(0, 2 ** 62, (size, words.shape[3]), dtype=numpy.uint64)
+            _tileWeights[words.shape[1:]] = weights * numpy.uint64(2) + numpy.uint64(1)
+        weights = _tileWeights[words.shape[1:]]
+        entry['tileHashes'] = (words * weights[numpy.newaxis, :, numpy.newaxis, :]).sum(axis=(1, 3), dtype=numpy.uint64)
+    return entry['tileHashes']
+
+
+def _changedRects(changedTiles, width, height):
+    """
+    Returns a list of (left, top, right, bottom) pixel rectangles that cover
+    the True tiles of the 2D `changedTiles` array, clipped to the `width` and
+    `height` of the image. Runs of changed tiles in a tile row become one
+    rectangle, and identical runs in consecutive rows are merged.
+    """
+    size = DIRTY_TILE_SIZE
+    rects = []
+    openRuns = {}
+    for row in range(changedTiles.shape[0] + 1):
+        runs = set()
+        if row < changedTiles.shape[0]:
+            # The runs start where a tile changes after an unchanged one, and end where the reverse happens.
+            edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([0], changedTiles[row].view(numpy.int8), [0]))))
+            runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        for run in list(openRuns):
+            if run not in runs:
+                startRow = openRuns.pop(run)
+                rects.append((run[0] * size, startRow * size, min(run[1] * size, width), min(row * size, height)))
+        for run in runs:
+            openRuns.setdefault(run, row)
+    return rects
+
+
+def _locateAllDirty(needleImage, haystackImage, stateKey, kwargs):
+    """
+    Returns a tuple of the matches of locateAll(needleImage, haystackImage,
+    **kwargs), reusing the matches from the last search made with the same
+    `stateKey` (a needle and arguments) if the haystack is the same size.
+    The tiles of the haystack whose _tileHashes() changed since then are
+    searched, each widened by the needle's size so that every position
+    overlapping them is covered, and the earlier matches that don't overlap
+    them are carried forward. If DIRTY_MAX_AREA of the haystack changed, or
+    the last search stopped at its limit before the changes, the whole
+    haystack is searched instead.
+    """
+    limit = kwargs['limit'] if 'limit' in kwargs else (10000 if locateAll is _locateAll_opencv else None)
+    tileHashes = None
+    if not _NUMPY_UNAVAILABLE:
+        try:
+            tileHashes = _tileHashes(haystackImage)
+        except TypeError:
+            pass # not an 8-bit image, so search all of it every time
+    if kwargs.get('method') in ('features', 'edges') or kwargs.get('scales') is not None or kwargs.get('step', 1) != 1:
+        # These don't find the same matches in part of the haystack as in all of it. (Edge detection
+        # looks at the pixels around each edge, so a change next to a match can change its edges.)
+        tileHashes = None
+
+    with _dirtyStatesLock:
+        state = _dirtyStates.pop(stateKey, None)
+    matches = None
+    if state is not None and tileHashes is not None and state[0].shape == tileHashes.shape:
+        lastHashes, lastMatches = state
+        changedTiles = lastHashes != tileHashes
+        if changedTiles.mean() <= DIRTY_MAX_AREA:
+            matches = _rematchChangedTiles(needleImage, haystackImage, changedTiles, lastMatches, limit, kwargs)
+
+    if matches is None:
+        matches = tuple(locateAll(needleImage, haystackImage, **kwargs))
+    if tileHashes is not None:
+        with _dirtyStatesLock:
+            _dirtyStates[stateKey] = (tileHashes, matches)
+            while len(_dirtyStates) > RESULT_CACHE_SIZE:
+                _dirtyStates.popitem(last=False)
+    return matches
+
+
+def _rematchChangedTiles(needleImage, haystackImage, changedTiles, lastMatches, limit, kwargs):
+    """
+    Returns the matches in haystackImage, found by searching only around its
+    `changedTiles` and keeping the `lastMatches` elsewhere, or None if they
+    can't be worked out without searching all of it. See _locateAllDirty().
+    """
+    haystackWidth, haystackHeight = _imageSize(haystackImage)
+    needleWidth, needleHeight = _imageSize(needleImage)
+    region = kwargs.get('region') or (0, 0, haystackWidth, haystackHeight)
+    tileBoxes = _changedRects(changedTiles, haystackWidth, haystackHeight)
+
+    # Earlier matches that don't overlap a changed tile have exactly the same pixels, so they still match.
+    # The matches are keyed by their box, since the searched areas can overlap and find the same match twice.
+    matches = {}
+    for match in lastMatches:
+        if not any(match.left < right and left < match.left + match.width and match.top < bottom and top < match.top + match.height
+                   for left, top, right, bottom in tileBoxes):
+            matches[tuple(match[:4])] = match
+
+    searchedArea = 0
+    searchKwargs = dict(kwargs)
+    for left, top, right, bottom in tileBoxes:
+        left = max(left - needleWidth + 1, region[0])
+        top = max(top - needleHeight + 1, region[1])
+        right = min(right + needleWidth - 1, region[0] + region[2], haystackWidth)
+        bottom = min(bottom + needleHeight - 1, region[1] + region[3], haystackHeight)
+        if right - left < needleWidth or bottom - top < needleHeight:
+            continue # the needle doesn't fit here
+        searchKwargs['region'] = (left, top, right - left, bottom - top)
+        searchedArea += (right - left) * (bottom - top)
+        try:
+            for match in locateAll(needleImage, haystackImage, **searchKwargs):
+                matches[tuple(match[:4])] = match
+        except ImageNotFoundException:
+            pass
+
+    matches = sorted(matches.values(), key=lambda match: (match.top, match.left))
+    if limit is not None and len(lastMatches) >= limit:
+        # The last search stopped at its limit, so there may be unknown matches after its last one.
+        lastMatch = max((match.top, match.left) for match in lastMatches)
+        matches = [match for match in matches if (match.top, match.left) <= lastMatch]
+        if len(matches) < limit:
+            return None
+    _locateStats.last = {'dirtySearched': searchedArea / float(haystackWidth * haystackHeight)}
+    return tuple(matches[:limit])
+
+
+def _locateAllCached(needleImage, haystackImage, **kwargs):
+    """
+    Like locateAll(), except that if the same needle file was already
+    searched for with the same arguments in a haystack with the exact same
+    pixels, the remembered matches are returned without searching again.
+    This makes polling an unchanged screen much cheaper: the screenshot still
+    has to be taken and fingerprinted, but not searched. If the screen has
+    changed, only the changed parts are searched again (see
+    _locateAllDirty()).
+
+    Only needle filenames are remembered, since numpy arrays and PIL images
+    can be modified by the caller. At most RESULT_CACHE_SIZE results are
+    remembered, and invalidateLocateCache() forgets all of them.
+    """
+    needleKey = _needleCacheKey(needleImage)
+    try:
+        key = (needleKey, _frameFingerprint(haystackImage), GRAYSCALE_DEFAULT,
+               tuple(sorted((name, _freeze(value)) for name, value in kwargs.items())))
+        hash(key)
+    except TypeError:
+        needleKey = None # an argument can't be part of a key, so don't cache this search
+    if needleKey is None:
+        for match in locateAll(needleImage, haystackImage, **kwargs):
+            yield match
+        return
+
+    with _resultCacheLock:
+        cached = _resultCache.pop(key, None)
+        if cached is not None:
+            _resultCache[key] = cached # (re)inserting marks this as the most recently used result
+    if cached is None:
+        try:
+            cached = (_locateAllDirty(needleImage, haystackImage, key[:1] + key[2:], kwargs), None)
+        except ImageNotFoundException as ex:
+            cached = ((), str(ex))
+        with _resultCacheLock:
+            _resultCache[key] = cached
+            while len(_resultCache) > RESULT_CACHE_SIZE:
+                _resultCache.popitem(last=False)
+
+    matches, notFoundMessage = cached
+    if len(matches) == 0 and USE_IMAGE_NOT_FOUND_EXCEPTION:
+        raise ImageNotFoundException(notFoundMessage or 'Could not locate the image.')
+    for match in matches:
+        yield match
+
+
 def locateOnScreen(image, minSearchTime=0, **kwargs):
     """TODO - rewrite this
     minSearchTime - amount of time in seconds to repeat taking
     screenshots and trying to locate a match.  The default of 0 performs
-    a single search.
+    a single search. See waitForImage().
     """
-    start = time.time()
-    while True:
+    if minSearchTime > 0:
+        return waitForImage(image, minSearchTime, **kwargs)
+
+    screenshotIm = screenshot(region=None) # the locateAll() function must handle cropping to return accurate coordinates, so don't pass a region here.
+    return _locateOnScreenshot(image, screenshotIm, kwargs)
+
+
+def _locateOnScreenshot(image, screenshotIm, kwargs):
+    """
+    Returns the first match of `image` in the screenshot screenshotIm, or
+    None, for locateOnScreen() and alocateOnScreen().
+    """
+    kwargs['limit'] = 1
+    try:
+        matches = tuple(_locateAllCached(image, screenshotIm, **kwargs))
+    finally:
         try:
-            screenshotIm = screenshot(region=None) # the locateAll() function must handle cropping to return accurate coordinates, so don't pass a region here.
-            retVal = locate(image, screenshotIm, **kwargs)
+            screenshotIm.fp.close()
+        except AttributeError:
+            # Screenshots on Windows won't have an fp since they came from
+            # ImageGrab, not a file. Screenshots on Linux will have fp set
+            # to None since the file has been unlinked
+            pass
+    return matches[0] if matches else None
+
+
+def _waitForScreen(image, timeout, region, appear, kwargs):
+    """
+    Searches the screen for `image` until it appears (if `appear` is True)
+    or is gone (if `appear` is False), or until `timeout` seconds have
+    passed. Returns a (done, match) tuple of whether it happened and the
+    first match on the last screenshot searched, if any.
+
+    Rather than searching back to back, it waits between screenshots, and
+    only searches a screenshot if the region's pixels changed since the last
+    search. The wait starts at WAIT_MIN_INTERVAL and doubles each time the
+    region is unchanged, up to WAIT_MAX_INTERVAL, and invalidateLocateCache()
+    (called after every mouse and keyboard action) cuts it short.
+    """
+    kwargs['limit'] = 1
+    kwargs['region'] = region
+    deadline = None if timeout is None else time.time() + timeout
+    interval = WAIT_MIN_INTERVAL
+    lastFingerprint = match = None
+    while True:
+        inputCount = _inputCount
+        screenshotIm = screenshot(region=None) # the locateAll() function must handle cropping to return accurate coordinates, so don't pass a region here.
+        searchedArea = screenshotIm.crop((region[0], region[1], region[0] + region[2], region[1] + region[3])) if region else screenshotIm
+        fingerprint = _frameFingerprint(searchedArea)
+        if fingerprint == lastFingerprint:
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
+        else:
+            lastFingerprint = fingerprint
+            interval = WAIT_MIN_INTERVAL
             try:
-                screenshotIm.fp.close()
-            except AttributeError:
-                # Screenshots on Windows won't have an fp since they came from
-                # ImageGrab, not a file. Screenshots on Linux will have fp set
-                # to None since the file has been unlinked
-                pass
-            if retVal or time.time() - start > minSearchTime:
-                return retVal
-        except ImageNotFoundException:
-            if time.time() - start > minSearchTime:
-                if USE_IMAGE_NOT_FOUND_EXCEPTION:
-                    raise
-                else:
-                    return None
+                matches = tuple(_locateAllCached(image, screenshotIm, **kwargs))
+            except ImageNotFoundException:
+                matches = ()
+            match = matches[0] if matches else None
+            if (match is not None) == appear:
+                return True, match
+
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            return False, match
+        with _screenChanged:
+            if _inputCount == inputCount: # if there's been input since the screenshot, look again right away
+                _screenChanged.wait(interval if deadline is None else min(interval, deadline - now))
+
+
+def waitForImage(image, timeout=None, region=None, **kwargs):
+    """
+    Waits until `image` is on the screen (or in `region` of it) and returns
+    its (left, top, width, height) Box, like locateOnScreen(). Returns None,
+    or raises ImageNotFoundException, if it doesn't appear within `timeout`
+    seconds (or waits forever if `timeout` is None). The screen is checked
+    at most every WAIT_MIN_INTERVAL seconds and less often while it's idle,
+    so a long wait uses little CPU. See _waitForScreen().
+    """
+    appeared, match = _waitForScreen(image, timeout, region, True, kwargs)
+    if appeared:
+        return match
+    if USE_IMAGE_NOT_FOUND_EXCEPTION:
+        raise ImageNotFoundException('Could not locate the image within %s seconds.' % (timeout,))
+    return None
+
+
+def waitForImageToVanish(image, timeout=None, region=None, **kwargs):
+    """
+    Waits until `image` isn't on the screen (or in `region` of it). Returns
+    True once it's gone, or False if it's still there after `timeout`
+    seconds (or waits forever if `timeout` is None). See waitForImage().
+    """
+    vanished, match = _waitForScreen(image, timeout, region, False, kwargs)
+    return vanished
 
 
 def locateAllOnScreen(image, **kwargs):
 
     # TODO - Should this raise an exception if zero instances of the image can be found on the screen, instead of always returning a generator?
     screenshotIm = screenshot(region=None) # the locateAll() function must handle cropping to return accurate coordinates, so don't pass a region here.
-    retVal = locateAll(image, screenshotIm, **kwargs)
+    retVal = _locateAllCached(image, screenshotIm, **kwargs)
     try:
         screenshotIm.fp.close()
     except AttributeError:
@@ -397,23 +2571,114 @@ def locateCenterOnScreen(image, **kwargs):
         return center(coords)
 
 
-def locateCenterOnScreenNear(x, y, needleImage):
-    def distanceBetweenPoints(x1, y1, x2, y2):
-        return sqrt(((x2 - x1) ** 2) + ((y2 - y1) ** 2))
+def _imageSize(img):
+    """
+    Returns the (width, height) of the image filename, PIL image, or OpenCV
+    numpy array `img`.
+    """
+    if isinstance(img, (str, unicode)):
+        if useOpenCV:
+            return _loadNeedle_cv2(img).shape[1::-1]
+        img = _loadNeedle_pillow(img)
+    if hasattr(img, 'convert'):
+        return img.size
+    return img.shape[1], img.shape[0]
+
+
+def locateNear(needleImage, haystackImage, x, y, **kwargs):
+    """
+    Returns the match of needleImage in haystackImage whose center is
+    nearest to (x, y), or None (or raises ImageNotFoundException) if there
+    are no matches. Instead of searching the whole haystack, it searches
+    squares centered on (x, y) that double in size each time, and stops at
+    the first square with a match close enough to (x, y) that no match
+    outside the square could be closer. This is much faster than
+    locateAll() when the needle is near (x, y), such as when it's near the
+    mouse cursor. The keyword arguments are the same as for locateAll().
+    """
+    startTime = time.time()
+    kwargs.pop('limit', None) # every match in a square is needed to find the nearest one
+    withScores = kwargs.pop('withScores', False)
+
+    if isinstance(haystackImage, (str, unicode)):
+        haystackImage = _openImageFile(haystackImage) # load the haystack once, rather than once per square
+    haystackWidth, haystackHeight = _imageSize(haystackImage)
+    region = kwargs.pop('region', None) or (0, 0, haystackWidth, haystackHeight)
+    right, bottom = min(region[0] + region[2], haystackWidth), min(region[1] + region[3], haystackHeight)
+    left, top = max(region[0], 0), max(region[1], 0)
+
+    # Scaled needles can be bigger than the needle image, so the first square must fit the biggest one.
+    scales = kwargs.get('scales')
+    if scales == 'auto':
+        scales = AUTO_SCALES
+    needleSize = max(_imageSize(needleImage)) * (max(scales) if scales else 1.0)
+    radius = int(needleSize) + 1
+
+    x, y = int(x), int(y)
+    while True:
+        square = (max(left, x - radius), max(top, y - radius), min(right, x + radius), min(bottom, y + radius))
+        coversRegion = square == (left, top, right, bottom)
+        squareRegion = (square[0], square[1], square[2] - square[0], square[3] - square[1])
+        try:
+            if _NUMPY_UNAVAILABLE:
+                matches = list(locateAll(needleImage, haystackImage, region=squareRegion, withScores=True, **kwargs))
+            else:
+                matches = locateAllArray(needleImage, haystackImage, region=squareRegion, **kwargs)
+        except ImageNotFoundException:
+            matches = []
+        except ValueError:
+            if coversRegion:
+                raise
+            matches = [] # the square is cut off by the edge of the haystack and is still smaller than the needle
+
+        nearest = None
+        if len(matches) > 0:
+            if _NUMPY_UNAVAILABLE:
+                distances = [(match.left + match.width / 2.0 - x) ** 2 + (match.top + match.height / 2.0 - y) ** 2 for match in matches]
+                nearestIndex = distances.index(min(distances))
+                nearest = matches[nearestIndex]
+            else:
+                distances = (matches['left'] + matches['width'] / 2.0 - x) ** 2 + (matches['top'] + matches['height'] / 2.0 - y) ** 2
+                nearestIndex = numpy.argmin(distances)
+                nearest = Match(*matches[nearestIndex].tolist())
+            # Every match whose center is within radius - needleSize / 2 of (x, y) fits inside the
+            # square, so no match outside of the square can be nearer than that.
+            if sqrt(distances[nearestIndex]) <= radius - needleSize / 2.0:
+                break
+        if coversRegion:
+            break
+        radius *= 2
+
+    if nearest is None:
+        if USE_IMAGE_NOT_FOUND_EXCEPTION:
+            raise ImageNotFoundException('Could not locate the image.')
+        return None
+    if withScores:
+        return nearest._replace(seconds=time.time() - startTime)
+    if scales is not None and kwargs.get('method') != 'features':
+        return ScaledBox(*(tuple(nearest[:4]) + (nearest.scale,)))
+    return Box(*nearest[:4])
 
-    images = list(locateAllOnScreen(needleImage))
-    distances = []
 
-    # getting distance of all points from given point
-    for image in images:
-        imageX, imageY = center(image)
-        distances.append(distanceBetweenPoints(x, y, imageX, imageY))
+def locateNearOnScreen(needleImage, x, y, **kwargs):
+    """
+    Returns the match of needleImage on the screen whose center is nearest
+    to (x, y). See locateNear().
+    """
+    screenshotIm = screenshot(region=None) # the locateNear() function must handle cropping to return accurate coordinates, so don't pass a region here.
+    return locateNear(needleImage, screenshotIm, x, y, **kwargs)
 
-    # index of minimum distance
-    minIndex = distances.index(min(distances))
 
-    # returning of center of found image at minimum distance from point
-    return center(images[minIndex])
+def locateCenterOnScreenNear(x, y, needleImage, **kwargs):
+    """
+    Returns the (x, y) center of the match of needleImage on the screen that
+    is nearest to (x, y), or None (or raises ImageNotFoundException) if it
+    isn't on the screen. See locateNear().
+    """
+    coords = locateNearOnScreen(needleImage, x, y, **kwargs)
+    if coords is None:
+        return None
+    return center(coords)
 
 
 def locateOnWindow(image, title, **kwargs):
@@ -434,6 +2699,182 @@ def locateOnWindow(image, title, **kwargs):
     return locateOnScreen(image, region=(win.left, win.top, win.width, win.height), **kwargs)
 
 
+# The needles and locateAll() keyword arguments used by a locateAllInFiles() worker process. These are set once by
+# _initLocateWorker() so that they don't have to be pickled and sent along with every haystack filename.
+_locateWorkerNeedles = ()
+_locateWorkerKwargs = {}
+
+
+def _initLocateWorker(needleImages, kwargs, atlasFilenames=()):
+    """
+    The initializer for locateAllInFiles() worker processes. Loads every needle
+    into this process's needle cache up front, so that the cache is already
+    warm when the first haystack arrives. The needle atlases that were loaded
+    in the parent process are loaded (that is, memory-mapped) again here,
+    since a worker process doesn't always start as a copy of its parent.
+    """
+    global _locateWorkerNeedles, _locateWorkerKwargs
+    _locateWorkerNeedles = tuple(needleImages)
+    _locateWorkerKwargs = dict(kwargs)
+    for atlasFilename in atlasFilenames:
+        if atlasFilename not in _loadedAtlases():
+            loadNeedleAtlas(atlasFilename)
+
+    grayscale = kwargs.get('grayscale')
+    for needleImage in _locateWorkerNeedles:
+        if locateAll is _locateAll_opencv:
+            _loadNeedle_cv2(needleImage, grayscale)
+        else:
+            _loadNeedle_pillow(needleImage, grayscale)
+
+
+def _toPython(value):
+    """
+    Returns `value` as a plain Python number, since the locate functions can
+    return numpy numbers which the json module can't serialize.
+    """
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _locateInFile(haystackFilename):
+    """
+    Searches the haystack image file for every needle given to
+    _initLocateWorker(). Returns a dict with the haystack filename, a dict of
+    needle filenames to lists of matches (each a list such as [left, top,
+    width, height]), and the
+    number of seconds it took. If the haystack couldn't be searched, the dict
+    has an 'error' key instead of 'matches'.
+    """
+    startTime = time.time()
+    result = {'haystack': haystackFilename}
+    try:
+        # Decode the haystack once, instead of once per needle. It's read-only, which
+        # lets the haystack cache share its conversions between the needles too.
+        haystackImage = _openImageFile(haystackFilename)
+
+        matches = {}
+        for needleImage in _locateWorkerNeedles:
+            try:
+                boxes = [[_toPython(value) for value in box] for box in locateAll(needleImage, haystackImage, **_locateWorkerKwargs)]
+            except ImageNotFoundException:
+                boxes = []
+            matches[needleImage] = boxes
+        result['matches'] = matches
+    except Exception as ex:
+        result['error'] = '%s: %s' % (type(ex).__name__, ex)
+    result['seconds'] = time.time() - startTime
+    return result
+
+
+def locateAllInFiles(needleImages, haystackFilenames, processes=None, **kwargs):
+    """
+    Searches each of the image files in `haystackFilenames` for each of the
+    needle image files in `needleImages`, spreading the haystacks across a
+    pool of `processes` worker processes (by default, one per CPU). Every
+    worker loads all of the needles once when it starts.
+
+    Returns a generator that yields a dict for each haystack, in the same
+    order as `haystackFilenames`, as soon as that haystack has been searched.
+    See _locateInFile() for the dict's contents. The keyword arguments are
+    passed to locateAll().
+    """
+    needleImages = list(needleImages)
+
+    if processes == 1:
+        # Search in this process, which is easier to debug.
+        _initLocateWorker(needleImages, kwargs)
+        for haystackFilename in haystackFilenames:
+            yield _locateInFile(haystackFilename)
+        return
+
+    pool = multiprocessing.Pool(processes, initializer=_initLocateWorker, initargs=(needleImages, kwargs, _loadedAtlases()))
+    try:
+        for result in pool.imap(_locateInFile, haystackFilenames):
+            yield result
+    finally:
+        # Also stop the workers if the caller didn't exhaust the generator.
+        pool.terminate()
+        pool.join()
+
+
+@requiresOpenCV
+def diffImages(imageA, imageB, tolerance=0, overlay=False):
+    """
+    Compares two images of the same size, such as screenshots of the same
+    window before and after a change, and returns an ImageDiff tuple of:
+
+    - boxes: a list of Box tuples around each connected area of changed
+      pixels, in top to bottom, left to right order.
+    - ratio: the fraction of the pixels that changed, from 0.0 to 1.0.
+    - overlay: if `overlay` is True, a BGR numpy array (which cv2.imwrite()
+      can save) of imageB with the changed pixels tinted red and the boxes
+      outlined in red, otherwise None.
+
+    The images can be filenames, PIL images, or numpy arrays, as with the
+    locate functions. A pixel has changed if any of its channels differs by
+    more than `tolerance`, which lets through slight differences such as
+    the ones from JPEG compression.
+    """
+    imageA = _loadHaystack_cv2(imageA, False)
+    imageB = _loadHaystack_cv2(imageB, False)
+    if imageA.shape != imageB.shape:
+        raise ValueError('the images must be the same size, not %s and %s' % (imageA.shape[1::-1], imageB.shape[1::-1]))
+
+    difference = cv2.absdiff(imageA, imageB)
+    if difference.ndim == 3:
+        difference = difference.max(axis=2)
+    changed = (difference > tolerance).astype(numpy.uint8)
+
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(changed, connectivity=8)
+    # Label 0 is the unchanged background.
+    boxes = [Box(*box) for box in stats[1:, :4].tolist()]
+    boxes.sort(key=lambda box: (box.top, box.left))
+    ratio = cv2.countNonZero(changed) / float(changed.size)
+
+    overlayImage = None
+    if overlay:
+        overlayImage = imageB.copy() if imageB.ndim == 3 else cv2.cvtColor(imageB, cv2.COLOR_GRAY2BGR)
+        changedPixels = changed.astype(bool)
+        overlayImage[changedPixels] = overlayImage[changedPixels] // 2 + numpy.uint8([0, 0, 127])
+        for left, top, width, height in boxes:
+            cv2.rectangle(overlayImage, (left, top), (left + width - 1, top + height - 1), (0, 0, 255), 1)
+    return ImageDiff(boxes, ratio, overlayImage)
+
+
+def _diffPair(kwargs, pair):
+    """
+    Calls diffImages() on the pair of images `pair` in a diffImagePairs()
+    worker process.
+    """
+    return diffImages(pair[0], pair[1], **kwargs)
+
+
+def diffImagePairs(pairs, processes=None, **kwargs):
+    """
+    Calls diffImages() on each (imageA, imageB) pair in `pairs`, spreading
+    the pairs across a pool of `processes` worker processes (by default, one
+    per CPU), and returns a generator that yields an ImageDiff for each pair
+    in the same order as `pairs`. Image filenames are cheaper to send to the
+    workers than images. The keyword arguments are passed to diffImages().
+    """
+    if processes == 1:
+        # Compare in this process, which is easier to debug.
+        for pair in pairs:
+            yield _diffPair(kwargs, pair)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(functools.partial(_diffPair, kwargs), pairs):
+            yield result
+    finally:
+        # Also stop the workers if the caller didn't exhaust the generator.
+        pool.terminate()
+        pool.join()
+
+
 @requiresPillow
 def showRegionOnScreen(region, outlineColor='red', filename='_showRegionOnScreen.png'):
     # TODO - This function is useful! Document it!
@@ -550,18 +2991,109 @@ def _kmp(needle, haystack, _dummy): # Knuth-Morris-Pratt search algorithm implem
             yield startPos
 
 
-def _steppingFind(needle, haystack, step):
+def _rowFind(needleImage, haystackImage):
     """
-    TODO
+    Yields the (x, y) of every position where the PIL image needleImage
+    exactly matches haystackImage, from left to right and then top to
+    bottom. Each haystack row is searched for the needle's first row with
+    _kmp(), and the rest of the needle's rows are compared where it's found.
     """
-    for startPos in range(0, len(haystack) - len(needle) + 1):
-        foundMatch = True
-        for pos in range(0, len(needle), step):
-            if haystack[startPos + pos] != needle[pos]:
-                foundMatch = False
-                break
-        if foundMatch:
-            yield startPos
+    needleWidth, needleHeight = needleImage.size
+    haystackWidth, haystackHeight = haystackImage.size
+
+    needleImageData = tuple(needleImage.getdata())
+    haystackImageData = tuple(haystackImage.getdata())
+
+    needleImageRows = [needleImageData[y * needleWidth:(y+1) * needleWidth] for y in range(needleHeight)] # LEFT OFF - check this
+    needleImageFirstRow = needleImageRows[0]
+
+    assert len(needleImageFirstRow) == needleWidth, 'For some reason, the calculated width of first row of the needle image is not the same as the width of the image.'
+    assert [len(row) for row in needleImageRows] == [needleWidth] * needleHeight, 'For some reason, the needleImageRows aren\'t the same size as the original image.'
+
+    for y in range(haystackHeight): # start at the leftmost column
+        for matchx in _kmp(needleImageFirstRow, haystackImageData[y * haystackWidth:(y+1) * haystackWidth], 1):
+            foundMatch = True
+            for searchy in range(1, needleHeight):
+                haystackStart = (searchy + y) * haystackWidth + matchx
+                if needleImageData[searchy * needleWidth:(searchy+1) * needleWidth] != haystackImageData[haystackStart:haystackStart + needleWidth]:
+                    foundMatch = False
+                    break
+            if foundMatch:
+                yield matchx, y
+
+
+def _exactSamples(needleArray):
+    """
+    Returns the (y, x) positions of up to EXACT_SAMPLE_PIXELS needle pixels
+    to compare first in _exactFind(), which are the first pixels of the
+    needle's rarest colors, rarest first. A rare color in the needle is
+    usually rare in the haystack too, so few positions match it.
+    """
+    if needleArray.ndim == 3:
+        # Pack each pixel's channels into one number, so that each color is one value.
+        codes = numpy.zeros(needleArray.shape[:2], dtype=numpy.int64)
+        for channel in range(needleArray.shape[2]):
+            codes = (codes << 8) | needleArray[:, :, channel]
+    else:
+        codes = needleArray.astype(numpy.int64)
+    values, firstIndices, counts = numpy.unique(codes.ravel(), return_index=True, return_counts=True)
+    order = numpy.lexsort((firstIndices, counts))[:EXACT_SAMPLE_PIXELS]
+    ys, xs = numpy.unravel_index(firstIndices[order], codes.shape)
+    return list(zip(ys.tolist(), xs.tolist()))
+
+
+def _exactFind(needleArray, haystackArray, needleEntry, stats):
+    """
+    Yields the (x, y) of every position where the numpy array needleArray
+    exactly matches haystackArray, from left to right and then top to
+    bottom, the same as _rowFind() but much faster.
+
+    The first of the needle's _exactSamples() pixels is compared with the
+    haystack at every position at once, and the rest only at the positions
+    that are still candidates. The candidates that are left are then
+    compared with the needle a row at a time, all at once, dropping each
+    candidate as soon as a row doesn't match. The number of candidates after
+    the first sample pixel, after all of them, and after the whole needle
+    are put in `stats` as 'exactCandidates', 'exactSurvivors', and
+    'exactMatches'. The sample pixels are kept in `needleEntry`.
+    """
+    needleHeight, needleWidth = needleArray.shape[:2]
+    rows = haystackArray.shape[0] - needleHeight + 1
+    cols = haystackArray.shape[1] - needleWidth + 1
+    stats['exactCandidates'] = stats['exactSurvivors'] = stats['exactMatches'] = 0
+    if rows <= 0 or cols <= 0 or needleArray.ndim != haystackArray.ndim:
+        return # the needle can't fit, or one image is grayscale and the other isn't
+
+    if 'exactSamples' not in needleEntry:
+        needleEntry['exactSamples'] = _exactSamples(needleArray)
+    samples = needleEntry['exactSamples']
+
+    sampleY, sampleX = samples[0]
+    equal = haystackArray[sampleY:sampleY + rows, sampleX:sampleX + cols] == needleArray[sampleY, sampleX]
+    if equal.ndim == 3:
+        equal = equal.all(axis=2)
+    candidateYs, candidateXs = numpy.nonzero(equal) # nonzero() returns them in row-major order
+    stats['exactCandidates'] = len(candidateYs)
+
+    for sampleY, sampleX in samples[1:]:
+        equal = haystackArray[candidateYs + sampleY, candidateXs + sampleX] == needleArray[sampleY, sampleX]
+        if equal.ndim == 2:
+            equal = equal.all(axis=1)
+        candidateYs, candidateXs = candidateYs[equal], candidateXs[equal]
+    stats['exactSurvivors'] = len(candidateYs)
+
+    columns = numpy.arange(needleWidth)
+    for y in range(needleHeight):
+        if len(candidateYs) == 0:
+            return
+        # Each candidate's row of haystack pixels, one candidate per row of this array.
+        equal = haystackArray[(candidateYs + y)[:, numpy.newaxis], candidateXs[:, numpy.newaxis] + columns] == needleArray[y]
+        equal = equal.reshape(len(candidateYs), -1).all(axis=1)
+        candidateYs, candidateXs = candidateYs[equal], candidateXs[equal]
+    stats['exactMatches'] = len(candidateYs)
+
+    for y, x in zip(candidateYs.tolist(), candidateXs.tolist()):
+        yield x, y
 
 
 def center(coords):
@@ -621,11 +3153,22 @@ def pixel(x, y):
 if sys.platform.startswith('java'):
     raise NotImplementedError('Jython is not yet supported by PyScreeze.')
 elif sys.platform == 'darwin':
-    screenshot = _screenshot_osx
+    _platformScreenshot = _screenshot_osx
 elif sys.platform == 'win32':
-    screenshot = _screenshot_win32
+    _platformScreenshot = _screenshot_win32
 else: # TODO - Make this more specific. "Anything else" does not necessarily mean "Linux".
-    screenshot = _screenshot_linux
+    _platformScreenshot = _screenshot_linux
+
+
+def screenshot(*args, **kwargs):
+    """
+    Takes a screenshot with this platform's screenshot function and returns
+    it as a PIL image. The searches of the same screenshot share its
+    conversions (see _markScreenFrame()), so it must not be modified in
+    place after it has been searched.
+    """
+    return _markScreenFrame(_platformScreenshot(*args, **kwargs))
+
 
 grab = screenshot # for compatibility with Pillow/PIL's ImageGrab module.
 
@@ -797,6 +797,48 @@ class TestFailSafe(unittest.TestCase):
         pygb.FAILSAFE = self.oldFailsafeSetting
 
 
+def stripedImage(width=20, height=20, stripeColor=(0, 0, 0)):
+    """Returns a white image with a two-pixel-wide vertical stripe of
+    stripeColor every four pixels, which is the needle that most of the
+    locate tests search for.
+    """
+    from PIL import Image
+
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    for i in range(0, width, 4):
+        image.paste(stripeColor, (i, 0, i + 2, height))
+    return image
+
+
+def screenImage(needle, size, positions, background=(237, 28, 36)):
+    """Returns an image of the given (width, height) size that is filled with
+    the background color and has the needle image pasted at each of the
+    (left, top) positions.
+    """
+    from PIL import Image
+
+    image = Image.new("RGB", size, background)
+    for position in positions:
+        image.paste(needle, position)
+    return image
+
+
+def buttonImage(foreground, background):
+    """Returns a 60x30 image of a button outline with three lines inside it,
+    drawn in the foreground color on the background color, for the tests of
+    method="edges".
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (60, 30), background)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((2, 2, 57, 27), outline=foreground)
+    draw.line((12, 8, 22, 22), fill=foreground)
+    draw.line((40, 8, 50, 22), fill=foreground)
+    draw.line((30, 8, 30, 22), fill=foreground)
+    return image
+
+
 class TestPyScreezeFunctions(unittest.TestCase):
     def test_locateFunctions(self):
         # TODO - for now, we only test that the "return None" and "raise pygb.ImageNotFoundException" is raised.
@@ -830,6 +872,625 @@ class TestPyScreezeFunctions(unittest.TestCase):
             pygb.locateCenterOnScreen("100x100blueimage.png"), None
         )  # NOTE: This test fails if there is a blue square visible on the screen.
 
+    def test_locateAllInFiles(self):
+        results = list(
+            pygb.locateAllInFiles(
+                ["100x100blueimage.png"], ["100x100blueimage.png", "100x100redimage.png", "missing.png"], processes=1
+            )
+        )
+        self.assertEqual([result["haystack"] for result in results], ["100x100blueimage.png", "100x100redimage.png", "missing.png"])
+        self.assertEqual(results[0]["matches"], {"100x100blueimage.png": [[0, 0, 100, 100]]})
+        self.assertIn("error", results[2])
+        for result in results:
+            self.assertGreaterEqual(result["seconds"], 0)
+
+    def test_locateWithScores(self):
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        needle = Image.frombytes("RGB", (30, 20), bytes(randomGenerator.randrange(256) for i in range(30 * 20 * 3)))
+        haystack = Image.new("RGB", (200, 150), (10, 200, 30))
+        haystack.paste(needle, (60, 70))
+        haystack.paste(needle, (10, 10))
+
+        matches = list(pygb.locateAll(needle, haystack, withScores=True))
+        self.assertEqual([tuple(match[:4]) for match in matches], [(10, 10, 30, 20), (60, 70, 30, 20)])
+        for match in matches:
+            self.assertAlmostEqual(match.score, 1.0, places=3)
+            self.assertEqual(match.scale, 1.0)
+            self.assertGreaterEqual(match.seconds, 0)
+
+        matchArray = pygb.locateAllArray(needle, haystack)
+        self.assertEqual(list(matchArray["left"]), [10, 60])
+        self.assertEqual(list(matchArray["top"]), [10, 70])
+
+    def test_locateAllPillowStep(self):
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        haystack = Image.frombytes("RGB", (200, 150), bytes(randomGenerator.choice((0, 128, 255)) for i in range(200 * 150 * 3)))
+        needle = haystack.crop((120, 80, 150, 100))
+        haystack.paste(needle, (10, 10))
+
+        # Stepping only skips comparisons, so the matches are the same exact matches for every step.
+        for step in (1, 2, 4):
+            self.assertEqual(
+                list(pygb.pyscreen._locateAll_python(needle, haystack, step=step)),
+                [(10, 10, 30, 20), (120, 80, 30, 20)],
+            )
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "the exact-match search requires NumPy")
+    def test_locateAllPillowExact(self):
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        haystack = Image.frombytes("RGB", (200, 150), bytes(randomGenerator.choice((0, 128, 255)) for i in range(200 * 150 * 3)))
+        needle = haystack.crop((120, 80, 150, 100))
+        haystack.paste(needle, (10, 10))
+
+        # The vectorized search finds the same matches, in the same order, as the row-by-row one.
+        expected = list(pygb.pyscreen._rowFind(needle, haystack))
+        self.assertEqual(expected, [(10, 10), (120, 80)])
+        self.assertEqual([tuple(box[:2]) for box in pygb.pyscreen._locateAll_python(needle, haystack)], expected)
+        stats = pygb.getLastLocateStats()
+        self.assertTrue(stats["exactCandidates"] >= stats["exactSurvivors"] >= stats["exactMatches"] == 2)
+
+        # A higher step takes the same search, rather than a slower one.
+        for step in (2, 4):
+            self.assertEqual([tuple(box[:2]) for box in pygb.pyscreen._locateAll_python(needle, haystack, step=step)], expected)
+            self.assertEqual(pygb.getLastLocateStats(), stats)
+
+        grayNeedle, grayHaystack = needle.convert("L"), haystack.convert("L")
+        self.assertEqual(list(pygb.pyscreen._locateAll_python(grayNeedle, grayHaystack, limit=1)), [(10, 10, 30, 20)])
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "confidence without OpenCV requires NumPy")
+    def test_locateAllPillowConfidence(self):
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        haystack = Image.frombytes("RGB", (200, 150), bytes(randomGenerator.randrange(256) for i in range(200 * 150 * 3)))
+        needle = haystack.crop((120, 80, 160, 110))
+        needle.putpixel((5, 5), (0, 0, 0))  # no longer an exact match
+
+        pygb.useImageNotFoundException(False)
+        self.assertEqual(list(pygb.pyscreen._locateAll_python(needle, haystack)), [])
+        matches = list(pygb.pyscreen._locateAll_python(needle, haystack, confidence=0.9, withScores=True))
+        self.assertEqual([tuple(match[:4]) for match in matches], [(120, 80, 40, 30)])
+        self.assertGreater(matches[0].score, 0.9)
+        self.assertLess(matches[0].score, 1.0)
+
+    def test_locateResultCache(self):
+        from PIL import Image
+
+        pygb.invalidateLocateCache()
+        firstScreen = Image.open("100x100blueimage.png").convert("RGB")
+        sameScreen = Image.open("100x100blueimage.png").convert("RGB")
+        expected = [(0, 0, 100, 100)]
+        self.assertEqual(list(pygb.pyscreen._locateAllCached("100x100blueimage.png", firstScreen)), expected)
+        self.assertEqual(len(pygb.pyscreen._resultCache), 1)
+
+        # An identical screenshot reuses the result instead of adding another one.
+        self.assertEqual(list(pygb.pyscreen._locateAllCached("100x100blueimage.png", sameScreen)), expected)
+        self.assertEqual(len(pygb.pyscreen._resultCache), 1)
+
+        pygb.moveRel(0, 0)  # any input discards the remembered results
+        self.assertEqual(len(pygb.pyscreen._resultCache), 0)
+
+    def test_locateFrameConversionCache(self):
+        from PIL import Image
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage(stripeColor=(0, 0, 255))
+        haystack = Image.new("RGBA", (100, 100), (237, 28, 36, 255))
+        haystack.paste(needle, (31, 41))
+        pygb.pyscreen._markScreenFrame(haystack)  # as if screenshot() had taken it
+        for grayscale in (False, True):
+            for region in (None, (1, 1, 99, 99)):
+                self.assertEqual(tuple(pygb.locate(needle, haystack, grayscale=grayscale, region=region)), (31, 41, 20, 20))
+
+        # Every search of the frame shares one conversion for each color mode.
+        entry = pygb.pyscreen._getHaystackCacheEntry(haystack)
+        prefix = 'cv2' if pygb.pyscreen.useOpenCV else 'pillow'
+        self.assertEqual(sorted(key[1] for key in entry if key[0] == prefix and len(key) == 2), [False, True])
+
+        # Other images can be changed in place between searches.
+        image = screenImage(needle, (200, 150), [(30, 40)])
+        for grayscale in (False, True):
+            self.assertEqual(tuple(pygb.locate(needle, image, grayscale=grayscale)), (30, 40, 20, 20))
+        image.paste((237, 28, 36), (30, 40, 50, 60))
+        image.paste(needle, (120, 100))
+        for grayscale in (False, True):
+            self.assertEqual(tuple(pygb.locate(needle, image, grayscale=grayscale)), (120, 100, 20, 20))
+        self.assertEqual(pygb.pyscreen._getHaystackCacheEntry(image), {})
+
+    def test_waitForImage(self):
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        emptyScreen = screenImage(needle, (300, 200), [])
+        fullScreen = screenImage(needle, (300, 200), [(150, 50)])
+        screens = [emptyScreen]
+
+        def changeScreen():
+            time.sleep(0.3)
+            screens[0] = fullScreen
+            pygb.moveRel(0, 0)  # input wakes up the waiting function
+
+        oldScreenshot = pygb.pyscreen.screenshot
+        pygb.pyscreen.screenshot = lambda region=None: screens[0]
+        try:
+            self.assertEqual(pygb.waitForImage(needle, 0.2), None)
+            self.assertTrue(pygb.waitForImageToVanish(needle, 0.2, region=(0, 0, 300, 200)))
+
+            threading.Thread(target=changeScreen).start()
+            startTime = time.time()
+            self.assertEqual(tuple(pygb.waitForImage(needle, 5)), (150, 50, 20, 20))
+            self.assertTrue(time.time() - startTime < 2)
+            self.assertEqual(tuple(pygb.locateOnScreen(needle, minSearchTime=1)), (150, 50, 20, 20))
+            self.assertFalse(pygb.waitForImageToVanish(needle, 0.2))
+        finally:
+            pygb.pyscreen.screenshot = oldScreenshot
+
+    @unittest.skipIf(sys.version_info[0:2] < (3, 5), "the asyncio functions require Python 3.5")
+    def test_asyncLocate(self):
+        import asyncio
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        screen = screenImage(needle, (300, 200), [(150, 50)])
+        screenshotCount = [0]
+
+        def slowScreenshot(imageFilename=None, region=None):
+            screenshotCount[0] += 1
+            time.sleep(0.2)
+            return screen
+
+        oldScreenshot = pygb.pyscreen.screenshot
+        pygb.pyscreen.screenshot = slowScreenshot
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # Concurrent calls share one screenshot.
+            results = loop.run_until_complete(asyncio.gather(
+                pygb.alocateOnScreen(needle), pygb.alocateCenterOnScreen(needle), pygb.alocateAllOnScreen(needle)))
+            self.assertEqual(results, [(150, 50, 20, 20), (160, 60), [(150, 50, 20, 20)]])
+            self.assertEqual(screenshotCount[0], 1)
+
+            self.assertEqual(tuple(loop.run_until_complete(pygb.alocate(needle, screen))), (150, 50, 20, 20))
+            self.assertEqual(tuple(loop.run_until_complete(pygb.alocateOnScreen(needle, minSearchTime=1))), (150, 50, 20, 20))
+            with self.assertRaises(asyncio.TimeoutError):
+                loop.run_until_complete(pygb.alocateOnScreen(needle, timeout=0.05))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            pygb.pyscreen.screenshot = oldScreenshot
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "searching only the changed tiles requires NumPy")
+    def test_locateChangedTiles(self):
+        import shutil
+        import tempfile
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        firstScreen = screenImage(needle, (300, 300), [(10, 10), (250, 250)])
+        secondScreen = firstScreen.copy()
+        secondScreen.paste((237, 28, 36), (10, 10, 30, 30))  # one match vanishes...
+        secondScreen.paste(needle, (40, 20))  # ...and another appears next to it
+
+        directory = tempfile.mkdtemp()
+        try:
+            needleFilename = os.path.join(directory, "stripes.png")
+            needle.save(needleFilename)
+            self.assertEqual(list(pygb.pyscreen._locateAllCached(needleFilename, firstScreen)), [(10, 10, 20, 20), (250, 250, 20, 20)])
+            self.assertEqual(list(pygb.pyscreen._locateAllCached(needleFilename, secondScreen)), [(40, 20, 20, 20), (250, 250, 20, 20)])
+            self.assertTrue(pygb.getLastLocateStats()["dirtySearched"] < 0.25)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_embedImage(self):
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        haystack = Image.frombytes("RGB", (200, 150), bytes(randomGenerator.choice((0, 128, 255)) for i in range(200 * 150 * 3)))
+        needle = haystack.crop((120, 80, 150, 100))
+
+        for imageFormat in ("png", "raw"):
+            embedded = pygb.embedImage(needle, format=imageFormat)
+            self.assertTrue(embedded.startswith("pygb:%s," % imageFormat))
+            self.assertEqual(tuple(pygb.locate(embedded, haystack)), (120, 80, 30, 20))
+            # The decoded image is kept, so the string isn't decoded again.
+            decoded = pygb.pyscreen._loadEmbeddedImage(embedded)
+            self.assertIs(pygb.pyscreen._loadEmbeddedImage(embedded), decoded)
+            self.assertEqual(list(decoded.getdata()), list(needle.getdata()))
+            self.assertEqual(tuple(pygb.locate(needle, pygb.embedImage(haystack, format=imageFormat))), (120, 80, 30, 20))
+
+        self.assertRaises(ValueError, pygb.embedImage, needle, format="gif")
+        self.assertRaises(ValueError, pygb.locate, "pygb:png,notAnImage", haystack)
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "memory-mapped images require NumPy")
+    def test_locateMemoryMappedImages(self):
+        import shutil
+        import tempfile
+        import numpy
+        from PIL import Image
+
+        randomGenerator = random.Random(42)
+        haystack = Image.frombytes("RGB", (200, 150), bytes(randomGenerator.choice((0, 128, 255)) for i in range(200 * 150 * 3)))
+        needle = haystack.crop((120, 80, 150, 100))
+        bgr = numpy.array(haystack)[:, :, ::-1]
+
+        directory = tempfile.mkdtemp()
+        try:
+            arrayFilename = os.path.join(directory, "haystack.npy")
+            numpy.save(arrayFilename, bgr)
+            rawFilename = os.path.join(directory, "haystack.raw")
+            numpy.dstack([bgr, numpy.full((150, 200), 255, numpy.uint8)]).tofile(rawFilename)
+            needleFilename = os.path.join(directory, "needle.npy")
+            numpy.save(needleFilename, bgr[80:100, 120:150])
+
+            rawImage = pygb.openRawImage(rawFilename, 200, 150)
+            self.assertEqual(rawImage.shape, (150, 200, 4))
+            for haystackImage in (arrayFilename, rawImage):
+                for needleImage in (needle, needleFilename):
+                    self.assertEqual(tuple(pygb.locate(needleImage, haystackImage)), (120, 80, 30, 20))
+                    self.assertEqual(tuple(pygb.locate(needleImage, haystackImage, region=(100, 50, 60, 60))), (120, 80, 30, 20))
+            del rawImage
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "needle atlases require NumPy")
+    def test_needleAtlas(self):
+        import shutil
+        import tempfile
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        haystack = screenImage(needle, (100, 100), [(30, 40)])
+
+        directory = tempfile.mkdtemp()
+        try:
+            needle.save(os.path.join(directory, "stripes.png"))
+            atlasFilename = os.path.join(directory, "needles.atlas")
+            self.assertEqual(pygb.compileNeedleAtlas(directory, atlasFilename), ["stripes"])
+            self.assertEqual(pygb.loadNeedleAtlas(atlasFilename), ["stripes"])
+
+            self.assertEqual(tuple(pygb.locate("atlas:stripes", haystack)), (30, 40, 20, 20))
+            self.assertEqual(tuple(pygb.locate("atlas:stripes", haystack, grayscale=True)), (30, 40, 20, 20))
+            with self.assertRaises(IOError):
+                pygb.locate("atlas:missing", haystack)
+        finally:
+            pygb.clearNeedleCache()  # release the memory-mapped atlas before deleting it
+            pygb.pyscreen._atlasNeedles.clear()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_locateNear(self):
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        haystack = screenImage(needle, (300, 200), [(10, 10), (200, 100), (150, 120)])
+
+        self.assertEqual(tuple(pygb.locateNear(needle, haystack, 0, 0)), (10, 10, 20, 20))
+        self.assertEqual(tuple(pygb.locateNear(needle, haystack, 210, 110)), (200, 100, 20, 20))
+        self.assertEqual(tuple(pygb.locateNear(needle, haystack, 190, 140)), (150, 120, 20, 20))
+        self.assertEqual(tuple(pygb.locateNear(needle, haystack, 0, 0, region=(100, 0, 200, 200))), (150, 120, 20, 20))
+        self.assertEqual(pygb.locateNear(needle, haystack, 0, 0, region=(50, 0, 90, 200)), None)
+
+        pygb.useImageNotFoundException()
+        with self.assertRaises(pygb.pyscreen.ImageNotFoundException):
+            pygb.locateNear(needle, haystack, 0, 0, region=(50, 0, 90, 200))
+        pygb.useImageNotFoundException(False)
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "the prefilter requires OpenCV")
+    def test_locatePrefilter(self):
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        needle.paste((255, 0, 0), (6, 6, 14, 14))  # the needle's rarest color
+        haystack = stripedImage(200, 200)
+        haystack.paste(needle, (120, 30))
+        haystack.paste(needle, (40, 150))
+
+        expected = list(pygb.locateAll(needle, haystack, confidence=0.99))
+        self.assertEqual(expected, [(120, 30, 20, 20), (40, 150, 20, 20)])
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99, prefilter=True)), expected)
+        self.assertTrue(pygb.getLastLocateStats()["prefilterSkipped"] > 0.5)
+
+        # Without the rare color in the haystack, nothing is searched. (A searched image
+        # mustn't be changed in place, so this changes a copy.)
+        haystack = haystack.copy()
+        haystack.paste((0, 0, 0), (120, 30, 140, 50))
+        haystack.paste((0, 0, 0), (40, 150, 60, 170))
+        self.assertEqual(pygb.locate(needle, haystack, confidence=0.99, prefilter=True), None)
+        self.assertEqual(pygb.getLastLocateStats()["prefilterSkipped"], 1.0)
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "confidence without OpenCV requires NumPy")
+    def test_locateVarianceRejection(self):
+        from PIL import Image
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        needle.paste((0, 0, 0), (0, 8, 20, 10))
+        haystack = screenImage(needle, (300, 200), [(120, 30), (40, 150)], background=(200, 200, 200))
+        for i in range(200, 260, 2):
+            haystack.paste((201, 201, 201), (i, 100, i + 1, 160))  # too faint to match the needle
+
+        # Most of the haystack is flat, so most of it isn't correlated with the needle (without OpenCV, the
+        # FFT correlates all of it at once, which is quicker for a haystack this small).
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99)), [(120, 30, 20, 20), (40, 150, 20, 20)])
+        if pygb.pyscreen.useOpenCV:
+            self.assertTrue(pygb.getLastLocateStats()["varianceSkipped"] > 0.5)
+
+        # A flat needle only matches flat windows of its own color.
+        self.assertEqual(pygb.locate(Image.new("RGB", (10, 10), (200, 200, 200)), haystack, confidence=0.9), (0, 0, 10, 10))
+        self.assertEqual(pygb.locate(Image.new("RGB", (10, 10), (0, 0, 255)), haystack, confidence=0.9), None)
+
+    @unittest.skipIf(pygb.pyscreen._NUMPY_UNAVAILABLE, "confidence without OpenCV requires NumPy")
+    def test_locateLowContrastCopy(self):
+        from PIL import Image
+
+        pygb.useImageNotFoundException(False)
+        needle = stripedImage()
+        # The faded copy correlates perfectly with the needle, but has far less than VARIANCE_MIN_RATIO of its variance.
+        haystack = screenImage(needle.point(lambda value: 200 + value // 255), (200, 120), [(50, 40)])
+
+        self.assertEqual(pygb.locate(needle, haystack, confidence=0.99), None)
+        if pygb.pyscreen.useOpenCV:
+            # explainLocate() agrees with locate().
+            report = pygb.explainLocate(needle, haystack, confidence=0.99)
+            self.assertFalse(report["found"])
+            self.assertTrue(report["bestScore"] < 0.99)
+            self.assertTrue(report["varianceSkipped"] > 0.5)
+
+        # On a busy haystack, where too little is flat to skip, the faded copy still isn't found.
+        rng = random.Random(0)
+        busy = Image.frombytes("RGB", (200, 120), bytes(bytearray(rng.randrange(256) for i in range(200 * 120 * 3))))
+        busy.paste(needle.point(lambda value: 200 + value // 255), (50, 40))
+        busy.paste(needle, (120, 60))
+        self.assertEqual(list(pygb.locateAll(needle, busy, confidence=0.99)), [(120, 60, 20, 20)])
+        if pygb.pyscreen.useOpenCV:
+            # Every position was correlated, so none of them count as skipped.
+            self.assertEqual(pygb.getLastLocateStats()["varianceSkipped"], 0.0)
+
+        oldRatio = pygb.pyscreen.VARIANCE_MIN_RATIO
+        pygb.pyscreen.VARIANCE_MIN_RATIO = 0
+        try:
+            self.assertEqual(tuple(pygb.locate(needle, haystack, confidence=0.99)), (50, 40, 20, 20))
+        finally:
+            pygb.pyscreen.VARIANCE_MIN_RATIO = oldRatio
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "streaming requires OpenCV")
+    def test_locateAllStream(self):
+        import numpy
+
+        needle = stripedImage(20, 21)
+        haystack = screenImage(needle, (200, 400), [(30, 10), (150, 140), (60, 270), (100, 379)])
+
+        # The bands together find the same matches as one search of the whole haystack.
+        for kwargs in ({}, {"step": 2, "confidence": 0.9}, {"region": (3, 7, 190, 390)}, {"limit": 2}):
+            expected = list(pygb.locateAll(needle, haystack, **kwargs))
+            self.assertEqual(list(pygb.locateAll(needle, haystack, stream=True, **kwargs)), expected)
+
+        # A haystack that can't be cached is converted once for all the bands, without changing the caller's array.
+        haystackArray = numpy.array(haystack)[:, :, ::-1].copy()
+        expected = list(pygb.locateAll(needle, haystack, grayscale=True))
+        self.assertEqual(list(pygb.locateAll(needle, haystackArray, stream=True, grayscale=True)), expected)
+        self.assertTrue(haystackArray.flags.writeable)
+
+        # The first match can be taken without searching the rest of the haystack.
+        matches = pygb.locateAll(needle, haystack, stream=True, withScores=True)
+        self.assertEqual(tuple(next(matches))[:4], (30, 10, 20, 21))
+        matches.close()
+        self.assertEqual(tuple(pygb.locate(needle, haystack)), (30, 10, 20, 21))
+
+        # The other functions that take locateAll()'s keyword arguments take these too.
+        matchArray = pygb.locateAllArray(needle, haystack, stream=True, withScores=True)
+        self.assertEqual(matchArray["top"].tolist(), [10, 140, 270, 379])
+        nearest = pygb.locateNear(needle, haystack, 150, 140, stream=True, withScores=True)
+        self.assertEqual(tuple(nearest)[:4], (150, 140, 20, 21))
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "trimming requires OpenCV")
+    def test_locateTrimmedNeedle(self):
+        from PIL import Image
+
+        pattern = stripedImage()
+        needle = Image.new("RGB", (40, 36), (200, 200, 200))
+        needle.paste(pattern, (12, 6))
+        haystack = Image.new("RGB", (200, 150), (90, 30, 30))
+        haystack.paste(needle, (10, 20))
+        haystack.paste(pattern, (100, 60))  # the pattern without the needle's margin
+        haystack.paste(pattern, (2, 130))  # too close to the edge for the whole needle to fit
+
+        pygb.useImageNotFoundException(False)
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99)), [(10, 20, 40, 36)])
+        expected = [(10, 20, 40, 36), (88, 54, 40, 36)]
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99, trim=True)), expected)
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99, trim=True, prefilter=True)), expected)
+        self.assertEqual(list(pygb.locateAll(needle, haystack, confidence=0.99, trim=True, region=(50, 10, 150, 120))),
+                         expected[1:])
+        self.assertEqual(pygb.pyscreen._loadTrimmedNeedle_cv2(needle, False, 1.0, 1)[2:], (12, 6))
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "calibration requires OpenCV")
+    def test_calibrateConfidence(self):
+        import shutil
+        import tempfile
+        from PIL import Image
+
+        needle = stripedImage()
+        similar = stripedImage()
+        similar.paste((255, 255, 255), (0, 16, 20, 20))  # the stripes stop short of the bottom
+        samples = []
+        for offset in (0, 40):
+            haystack = screenImage(needle, (150, 100), [(20 + offset, 30)])
+            haystack.paste(similar, (100 - offset // 2, 60))
+            samples.append(haystack)
+
+        directory = tempfile.mkdtemp()
+        try:
+            needleFilename = os.path.join(directory, "needle.png")
+            needle.save(needleFilename)
+            pygb.useImageNotFoundException(False)
+            self.assertEqual(list(pygb.locateAll(needleFilename, samples[0], limit=1)), [(20, 30, 20, 20)])
+
+            confidence = pygb.calibrateConfidence(needleFilename, samples)
+            self.assertTrue(0.8 < confidence < 0.999)
+            self.assertTrue(os.path.exists(os.path.join(directory, pygb.pyscreen.CALIBRATION_FILENAME)))
+
+            # The saved confidence is used by default, even once the needle cache has forgotten it.
+            pygb.clearNeedleCache()
+            self.assertEqual(pygb.pyscreen._calibratedConfidence(needleFilename, False), confidence)
+            self.assertEqual(pygb.pyscreen._calibratedConfidence(needleFilename, True), pygb.pyscreen.DEFAULT_CONFIDENCE)
+            self.assertEqual(tuple(pygb.locate(needleFilename, samples[1])), (60, 29, 20, 20))
+
+            # Changing the needle file discards its calibration.
+            similar.save(needleFilename)
+            pygb.clearNeedleCache()
+            self.assertEqual(pygb.pyscreen._calibratedConfidence(needleFilename, False), pygb.pyscreen.DEFAULT_CONFIDENCE)
+
+            self.assertRaises(pygb.pyscreen.PyScreezeException, pygb.calibrateConfidence, needle, [Image.new("RGB", (100, 100))])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "explainLocate() requires OpenCV")
+    def test_explainLocate(self):
+        needle = stripedImage()
+        haystack = screenImage(stripedImage(stripeColor=(0, 0, 255)), (200, 120), [(130, 50)])
+
+        # The blue stripes only match in grayscale.
+        report = pygb.explainLocate(needle, haystack, confidence=0.99)
+        self.assertFalse(report["found"])
+        self.assertEqual(tuple(report["candidates"][0])[:4], (130, 50, 20, 20))
+        self.assertTrue(report["lowerConfidence"] < report["bestScore"] < 0.99)
+        self.assertTrue(report["grayscaleWouldMatch"])
+        self.assertEqual(report["heatmap"].max(), report["bestScore"])
+        self.assertTrue(report["heatmap"].shape[1] <= pygb.pyscreen.EXPLAIN_HEATMAP_SIZE)
+        self.assertEqual(set(report["timings"]), set(["load", "convert", "match", "threshold"]))
+
+        haystack = haystack.copy()
+        haystack.paste(needle, (30, 40))
+        report = pygb.explainLocate(needle, haystack, confidence=0.99)
+        self.assertTrue(report["found"])
+        self.assertEqual(report["lowerConfidence"], None)
+        self.assertEqual([tuple(match)[:2] for match in report["candidates"][:2]], [(30, 40), (130, 50)])
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "diffImages() requires OpenCV")
+    def test_diffImages(self):
+        from PIL import Image
+
+        before = Image.new("RGB", (100, 80), (255, 255, 255))
+        after = Image.new("RGB", (100, 80), (250, 250, 250))
+        after.paste((0, 0, 0), (10, 50, 30, 60))
+        after.paste((0, 0, 255), (60, 5, 70, 25))
+
+        diff = pygb.diffImages(before, after, tolerance=10)
+        self.assertEqual(diff.boxes, [(60, 5, 10, 20), (10, 50, 20, 10)])
+        self.assertEqual(diff.ratio, 400 / 8000.0)
+        self.assertEqual(diff.overlay, None)
+
+        # Without a tolerance, the slightly darker background counts as a change too.
+        diff = pygb.diffImages(before, after, overlay=True)
+        self.assertEqual(diff.boxes, [(0, 0, 100, 80)])
+        self.assertEqual(diff.ratio, 1.0)
+        self.assertEqual(diff.overlay.shape, (80, 100, 3))
+
+        self.assertRaises(ValueError, pygb.diffImages, before, after.crop((0, 0, 50, 50)))
+
+        diffs = list(pygb.diffImagePairs([(before, after), (before, before)], processes=1, tolerance=10))
+        self.assertEqual([(len(diff.boxes), diff.ratio) for diff in diffs], [(2, 0.05), (0, 0.0)])
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "masked matching requires OpenCV")
+    def test_locateTransparentNeedle(self):
+        from PIL import Image
+
+        pattern = stripedImage()
+        haystack = screenImage(pattern, (100, 100), [(30, 40)])
+
+        # The needle's transparent border is green, which doesn't appear in the haystack at all.
+        needle = Image.new("RGBA", (30, 30), (0, 255, 0, 0))
+        needle.paste(pattern, (5, 5))
+        self.assertEqual(tuple(pygb.locate(needle, haystack, confidence=0.99)), (25, 35, 30, 30))
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "scaled matching requires OpenCV")
+    def test_locateScaledNeedle(self):
+        from PIL import Image
+
+        needle = Image.new("RGB", (20, 20), (255, 255, 255))
+        for i in range(0, 20, 4):
+            needle.paste((0, 0, 0), (i, 0, i + 2, 20))
+            needle.paste((0, 0, 255), (0, i, 20, i + 1))
+        haystack = Image.new("RGB", (100, 100), (237, 28, 36))
+        haystack.paste(needle.resize((30, 30)), (30, 40))
+
+        pygb.useImageNotFoundException(False)
+        self.assertEqual(pygb.locate(needle, haystack, confidence=0.9), None)
+        box = pygb.locate(needle, haystack, confidence=0.9, scales=[1.0, 1.25, 1.5])
+        self.assertEqual(tuple(box), (30, 40, 30, 30, 1.5))
+        self.assertEqual(tuple(pygb.locate(needle, haystack, confidence=0.9, scales=[box.scale])), tuple(box))
+        self.assertEqual(tuple(pygb.locateNear(needle, haystack, 0, 0, confidence=0.9, scales=[1.0, 1.25, 1.5])), tuple(box))
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "edge matching requires OpenCV")
+    def test_locateEdges(self):
+        from PIL import Image
+
+        # The needle is from a light theme, and the haystack is in a dark theme.
+        needle = buttonImage((0, 0, 0), (255, 255, 255))
+        haystack = Image.new("RGB", (300, 200), (40, 40, 40))
+        haystack.paste(buttonImage((230, 230, 230), (40, 40, 40)), (120, 90))
+        haystack.paste(buttonImage((200, 0, 0), (40, 40, 40)).transpose(Image.FLIP_LEFT_RIGHT), (20, 20))
+
+        pygb.useImageNotFoundException(False)
+        self.assertEqual(pygb.locate(needle, haystack, confidence=0.8), None)
+        expected = [(120, 90, 60, 30)]
+        self.assertEqual(list(pygb.locateAll(needle, haystack, method="edges", confidence=0.8)), expected)
+        self.assertEqual(list(pygb.locateAll(needle, haystack, method="edges", confidence=0.8, stream=True)), expected)
+        pygb.pyscreen._markScreenFrame(haystack)  # as if screenshot() had taken it
+        pygb.locate(needle, haystack, method="edges", confidence=0.8)
+        self.assertTrue("edges" in pygb.pyscreen._getHaystackCacheEntry(haystack))
+
+        self.assertRaises(ValueError, pygb.locate, Image.new("RGB", (20, 20)), haystack, method="edges")
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "edge matching requires OpenCV")
+    def test_locateEdgesChangedTiles(self):
+        import shutil
+        import tempfile
+        from PIL import Image
+
+        pygb.useImageNotFoundException(False)
+        firstScreen = Image.new("RGB", (256, 192), (40, 40, 40))
+        firstScreen.paste(buttonImage((230, 230, 230), (40, 40, 40)), (36, 34))  # its right side ends at a tile's edge
+        secondScreen = firstScreen.copy()
+        secondScreen.paste((230, 230, 230), (96, 32, 128, 64))  # only the tile next to the match changes
+
+        directory = tempfile.mkdtemp()
+        try:
+            needleFilename = os.path.join(directory, "button.png")
+            buttonImage((0, 0, 0), (255, 255, 255)).save(needleFilename)
+            self.assertEqual(list(pygb.pyscreen._locateAllCached(needleFilename, firstScreen, method="edges", confidence=0.999)), [(36, 34, 60, 30)])
+            # The new edge next to the button lowers its score, so the earlier match can't be carried forward.
+            self.assertEqual(list(pygb.pyscreen._locateAllCached(needleFilename, secondScreen, method="edges", confidence=0.999)), [])
+            self.assertFalse("dirtySearched" in pygb.getLastLocateStats())
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    @unittest.skipIf(not pygb.pyscreen.useOpenCV, "feature matching requires OpenCV")
+    def test_locateFeatures(self):
+        from PIL import Image, ImageDraw
+
+        needle = Image.new("RGB", (160, 120), (255, 255, 255))
+        draw = ImageDraw.Draw(needle)
+        randomGenerator = random.Random(42)
+        for i in range(60):
+            x, y = randomGenerator.randrange(150), randomGenerator.randrange(110)
+            color = (randomGenerator.randrange(256), randomGenerator.randrange(256), randomGenerator.randrange(256))
+            size = (x + randomGenerator.randrange(5, 25), y + randomGenerator.randrange(5, 25))
+            draw.ellipse((x, y) + size, fill=color, outline=(0, 0, 0))
+        haystack = Image.new("RGB", (800, 600), (200, 200, 200))
+        haystack.paste(needle.rotate(15, expand=True, fillcolor=(200, 200, 200)), (300, 200))
+
+        pygb.useImageNotFoundException(False)
+        self.assertEqual(pygb.locate(needle, haystack), None)
+        box = pygb.locate(needle, haystack, method="features")
+        # The rotated needle is 186 x 157 pixels, so its center is at (393, 278).
+        x, y = pygb.center(box)
+        self.assertAlmostEqual(x, 393, delta=6)
+        self.assertAlmostEqual(y, 278, delta=6)
+
 
 if __name__ == "__main__":
     unittest.main()